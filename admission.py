@@ -0,0 +1,275 @@
+# admission.py
+"""
+Admission control for the expensive LLM endpoints.
+
+Every caller (JWT subject, else client IP) has a token bucket, and every model
+has a concurrency limit with a short, bounded wait queue. Callers over their
+rate get a 429 and requests that cannot get a model slot in time get a 503,
+both with Retry-After, so a burst is turned away quickly instead of slowing
+down every request together.
+
+State is per process by default; set ADMISSION_BACKEND=sqlite (and
+ADMISSION_PATH) to share buckets and slots between uvicorn workers.
+"""
+import os
+import math
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+
+import metrics
+from auth import decode_token
+
+# Sustained LLM requests per caller, and how many may be made back to back
+ADMISSION_RATE_PER_MINUTE = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "6"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "5"))
+# Concurrent calls per model, e.g. ADMISSION_MODEL_CONCURRENCY="gpt-4o=8,gpt-3.5-turbo=16"
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", "8"))
+ADMISSION_MODEL_CONCURRENCY = {
+    model.strip(): int(limit)
+    for model, _, limit in (item.partition("=") for item in os.getenv("ADMISSION_MODEL_CONCURRENCY", "").split(","))
+    if model.strip() and limit.strip().isdigit()
+}
+# Requests allowed to wait for a slot per model, and for how long, before getting a 503
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+ADMISSION_PATH = os.getenv("ADMISSION_PATH", "./admission.db")
+# Behind a proxy (e.g. Render), take the client IP from X-Forwarded-For. Clients
+# can send their own entries, so use the one appended by the trusted proxies:
+# ADMISSION_PROXY_HOPS counts them from the right.
+ADMISSION_TRUST_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "0") == "1"
+ADMISSION_PROXY_HOPS = max(1, int(os.getenv("ADMISSION_PROXY_HOPS", "1")))
+
+RETRY_AFTER_SECONDS = 5
+# Slots not released by then (e.g. a worker crashed mid-call) are reclaimed
+SLOT_LEASE_SECONDS = 300
+POLL_INTERVAL = 0.05
+MAX_BUCKETS = 10000
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryStore:
+    """Buckets and slot counts for this process only."""
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._slots = {}  # model -> set of holders
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take a token from `key`'s bucket; returns 0, or the seconds until one is available."""
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # Evicted callers start again with a full bucket
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def acquire(self, model, limit, holder, now):
+        with self._lock:
+            held = self._slots.setdefault(model, set())
+            if len(held) >= limit:
+                return False
+            held.add(holder)
+            return True
+
+    def release(self, model, holder):
+        with self._lock:
+            self._slots.get(model, set()).discard(holder)
+
+
+class SQLiteStore:
+    """Buckets and slot leases in a SQLite file shared by all workers on the host."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        # Autocommit mode; each operation runs in its own BEGIN IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS admission_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS admission_slots "
+            "(holder TEXT PRIMARY KEY, model TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._takes = 0
+
+    def _transaction(self, func, *args):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _take(self, key, rate, burst, now):
+        row = self._conn.execute("SELECT tokens, updated FROM admission_buckets WHERE key = ?", (key,)).fetchone()
+        tokens = _refill(*row, now, rate, burst) if row else burst
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._conn.execute(
+            "INSERT OR REPLACE INTO admission_buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now)
+        )
+        self._takes += 1
+        if self._takes % 1000 == 0:
+            # Buckets idle long enough to be full again carry no state
+            self._conn.execute("DELETE FROM admission_buckets WHERE updated < ?", (now - burst / rate,))
+        return wait
+
+    def take(self, key, rate, burst, now):
+        return self._transaction(self._take, key, rate, burst, now)
+
+    def _acquire(self, model, limit, holder, now):
+        self._conn.execute("DELETE FROM admission_slots WHERE expires_at <= ?", (now,))
+        (held,) = self._conn.execute("SELECT COUNT(*) FROM admission_slots WHERE model = ?", (model,)).fetchone()
+        if held >= limit:
+            return False
+        self._conn.execute(
+            "INSERT INTO admission_slots (holder, model, expires_at) VALUES (?, ?, ?)",
+            (holder, model, now + SLOT_LEASE_SECONDS),
+        )
+        return True
+
+    def acquire(self, model, limit, holder, now):
+        return self._transaction(self._acquire, model, limit, holder, now)
+
+    def release(self, model, holder):
+        with self._lock:
+            self._conn.execute("DELETE FROM admission_slots WHERE holder = ?", (holder,))
+
+
+store = SQLiteStore(ADMISSION_PATH) if ADMISSION_BACKEND == "sqlite" else MemoryStore()
+
+_waiting = {}  # model -> requests in this process waiting for a slot
+_released = {}  # model -> event set when a slot in this process is released
+
+
+def _reject(status_code, detail, retry_after, reason, model):
+    metrics.ADMISSION_REJECTED.inc(reason=reason, model=model)
+    raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def caller_key(request: Request):
+    """The JWT subject when the request carries a valid token, else the client IP."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            payload = decode_token(token)
+            return f"user:{payload.get('uid') or payload.get('sub')}"
+        except HTTPException:
+            pass
+    # Multiple X-Forwarded-For headers count as one comma-separated list
+    forwarded = [
+        entry.strip()
+        for header in request.headers.getlist("X-Forwarded-For")
+        for entry in header.split(",")
+        if entry.strip()
+    ]
+    if ADMISSION_TRUST_PROXY and len(forwarded) >= ADMISSION_PROXY_HOPS:
+        return f"ip:{forwarded[-ADMISSION_PROXY_HOPS]}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def check_rate(request: Request, model):
+    """Charge one request to the caller's bucket, or raise a 429."""
+    wait = store.take(caller_key(request), ADMISSION_RATE_PER_MINUTE / 60, ADMISSION_BURST, time.time())
+    if wait > 0:
+        _reject(429, "Too many requests, please slow down", wait, "rate", model)
+
+
+class Slot:
+    """A held model slot; release it when the LLM call (or stream) is finished."""
+
+    def __init__(self, model, holder):
+        self.model = model
+        self.holder = holder
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        store.release(self.model, self.holder)
+        event = _released.pop(self.model, None)
+        if event is not None:
+            event.set()
+
+    async def guard(self, tokens):
+        """Pass a token stream through, releasing the slot when it ends or is abandoned."""
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            self.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+async def acquire(model, timeout=ADMISSION_QUEUE_TIMEOUT):
+    """
+    Wait for a slot on `model`. With a timeout the wait counts against
+    ADMISSION_QUEUE and ends in a 503; timeout=None waits indefinitely
+    (for background jobs, which are already bounded by their worker pool).
+    """
+    limit = ADMISSION_MODEL_CONCURRENCY.get(model, ADMISSION_CONCURRENCY)
+    holder = uuid.uuid4().hex
+    if store.acquire(model, limit, holder, time.time()):
+        return Slot(model, holder)
+
+    if timeout is not None and _waiting.get(model, 0) >= ADMISSION_QUEUE:
+        _reject(503, "The assistant is busy, please retry shortly", RETRY_AFTER_SECONDS, "queue_full", model)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    _waiting[model] = _waiting.get(model, 0) + 1
+    try:
+        while True:
+            event = _released.setdefault(model, asyncio.Event())
+            wait = POLL_INTERVAL if timeout is None else max(0.0, min(POLL_INTERVAL, started + timeout - loop.time()))
+            try:
+                # Local releases wake waiters at once; polling picks up other workers' releases
+                await asyncio.wait_for(event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            if store.acquire(model, limit, holder, time.time()):
+                metrics.ADMISSION_WAIT.observe(loop.time() - started, model=model)
+                return Slot(model, holder)
+            if timeout is not None and loop.time() - started >= timeout:
+                _reject(503, "The assistant is busy, please retry shortly", RETRY_AFTER_SECONDS, "timeout", model)
+    finally:
+        _waiting[model] -= 1
+
+
+async def admit(request: Request, model):
+    """Rate-check the caller, then wait for a model slot; returns the Slot to release."""
+    check_rate(request, model)
+    return await acquire(model)
@@ -1,22 +1,35 @@
 # auth.py
-from fastapi import Request, APIRouter, HTTPException, Depends
+from fastapi import Request, Response, APIRouter, HTTPException, Depends, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from models import Base, User, Itinerary, FavoritePlace, get_db, engine
+import base64
+from sqlalchemy import select, update, delete, insert, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Itinerary, ItineraryDay, FavoritePlace, get_db, get_async_db
+from itinerary import parse_itinerary, itinerary_days, store_days
+from cache import TTLCache
+from password_hashing import hash_password, verify_password
+from http_cache import cached_json, cache_control, etag_matches
 
 SECRET_KEY = "supersecretkey"  # Replace later with env var
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified token payloads and user profiles, so protected routes stay in memory
+TOKEN_CACHE_TTL = 300
+PROFILE_CACHE_TTL = 300
+
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL, name="token_cache")
+profile_cache = TTLCache(maxsize=5000, ttl=PROFILE_CACHE_TTL, name="profile_cache")
+email_id_cache = TTLCache(maxsize=5000, ttl=PROFILE_CACHE_TTL, name="email_id_cache")
 
-Base.metadata.create_all(bind=engine)
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 class UserCreate(BaseModel):
     name: str
@@ -25,11 +38,82 @@ class UserCreate(BaseModel):
     email: str
     password: str
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+class ItinerarySummary(BaseModel):
+    id: int
+    days: int | None = None
+    adults: int | None = None
+    children: int | None = None
+    transportation: str | None = None
+    ageRange: str | None = None
+    budget: str | None = None
+    priorities: str | None = None
+    createdAt: str | None = None
+
+class ItineraryDayOut(BaseModel):
+    day: int | None = None
+    title: str | None = None
+    morning: str | None = None
+    afternoon: str | None = None
+    evening: str | None = None
+    content: str | None = None
+
+class ItineraryDetail(ItinerarySummary):
+    content: str | None = None
+    day_plans: list[ItineraryDayOut] = []
+
+class ItineraryPage(BaseModel):
+    items: list[ItinerarySummary]
+    next_cursor: str | None = None
 
-def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
+class FavoriteOut(BaseModel):
+    id: int
+    user_id: int
+    name: str | None = None
+    description: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    created_at: datetime | None = None
+
+class FavoritePage(BaseModel):
+    items: list[FavoriteOut]
+    next_cursor: str | None = None
+
+class FavoriteIn(BaseModel):
+    name: str
+    description: str = ""
+    latitude: float
+    longitude: float
+
+class FavoriteSync(BaseModel):
+    add: list[FavoriteIn] = []
+    delete: list[int] = []
+
+def encode_cursor(created_at: datetime, row_id: int):
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_page(query, model, cursor: str | None, limit: int):
+    """Newest-first page on (created_at, id); returns (rows, next_cursor)."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < row_id),
+        ))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -37,11 +121,12 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# bcrypt runs in the password_hashing process pool, so these handlers only await it
 @router.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.email == user.email).first():
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    if await db.scalar(select(User.id).where(User.email == user.email)):
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed = get_password_hash(user.password)
+    hashed = await hash_password(user.password)
     db_user = User(
         name=user.name,
         surname=user.surname,
@@ -50,50 +135,92 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         hashed_password=hashed
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    # The email may have been cached for an account removed outside the API
+    invalidate_user(db_user.id, db_user.email)
     return {"message": "User created successfully"}
 
 @router.post("/login")
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form.username).first()
-    if not user or not verify_password(form.password, user.hashed_password):
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.email == form.username))
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_password(form.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = create_access_token(data={"sub": user.email})
+    if new_hash:
+        # Cost parameters changed since this hash was made: upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
+        invalidate_user(user.id, user.email)
+    token = create_access_token(data={"sub": user.email, "uid": user.id})
     return {"access_token": token, "token_type": "bearer"}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-@router.get("/me")
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_token(token: str):
+    """Verify a JWT, remembering the payload until it (or the cache entry) expires."""
+    payload = token_cache.get(token)
+    if payload is not None:
+        if payload.get("exp", 0) > datetime.utcnow().timestamp():
+            return payload
+        token_cache.delete(token)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        user = db.query(User).filter(User.email == email).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return {
-            "id": user.id,
-            "name": user.name,
-            "surname": user.surname,
-            "mobile": user.mobile,
-            "email": user.email,
-            "created_at": user.created_at.isoformat() if user.created_at else None
-        }
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    token_cache.set(token, payload)
+    return payload
 
-@router.post("/save-itinerary")
-def save_itinerary(itinerary: dict, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+def user_profile(user: User):
+    return {
+        "id": user.id,
+        "name": user.name,
+        "surname": user.surname,
+        "mobile": user.mobile,
+        "email": user.email,
+        "created_at": user.created_at.isoformat() if user.created_at else None
+    }
+
+def invalidate_user(user_id: int, email: str | None = None):
+    """Drop cached data for a user; call after changing or deleting their profile."""
+    profile_cache.delete(user_id)
+    if email:
+        email_id_cache.delete(email)
+
+def get_current_user_id(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    payload = decode_token(token)
+    user_id = payload.get("uid")
+    if user_id is not None:
+        return user_id
+
+    # Tokens issued before the uid claim existed: resolve the email once
     email = payload.get("sub")
-    user = db.query(User).filter(User.email == email).first()
+    user_id = email_id_cache.get(email)
+    if user_id is None:
+        user = db.query(User).filter(User.email == email).first()
+        if user is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        user_id = user.id
+        email_id_cache.set(email, user_id)
+        profile_cache.set(user_id, user_profile(user))
+    return user_id
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+@router.get("/me")
+def get_current_user(user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        profile = user_profile(user)
+        profile_cache.set(user_id, profile)
+    return profile
 
+@router.post("/save-itinerary")
+def save_itinerary(itinerary: dict, user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
     new_itinerary = Itinerary(
-        user_id=user.id,
+        user_id=user_id,
         days=itinerary["days"],
         adults=itinerary["adults"],
         children=itinerary["children"],
@@ -104,77 +231,174 @@ def save_itinerary(itinerary: dict, token: str = Depends(oauth2_scheme), db: Ses
         content=itinerary["content"]
     )
     db.add(new_itinerary)
+    db.flush()
+    # Days are stored separately so one of them can be regenerated later
+    store_days(db, new_itinerary.id, parse_itinerary(itinerary["content"]))
     db.commit()
     return {"message": "Itinerary saved"}
 
-@router.get("/user/itineraries")
-def get_user_itineraries(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    email = payload.get("sub")
-    user = db.query(User).filter(User.email == email).first()
+def itinerary_summary(it):
+    return {
+        "id": it.id,
+        "days": it.days,
+        "adults": it.adults,
+        "children": it.children,
+        "transportation": it.transportation,
+        "ageRange": it.age_range,
+        "budget": it.budget,
+        "priorities": it.priorities,
+        "createdAt": it.created_at.isoformat() if it.created_at else None
+    }
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+# Listing columns only: the large `content` column is fetched per itinerary
+ITINERARY_SUMMARY_COLUMNS = (
+    Itinerary.id, Itinerary.days, Itinerary.adults, Itinerary.children, Itinerary.transportation,
+    Itinerary.age_range, Itinerary.budget, Itinerary.priorities, Itinerary.created_at,
+)
 
-    itineraries = db.query(Itinerary).filter(Itinerary.user_id == user.id).all()
-    return [
-        {
-            "id": it.id,
-            "days": it.days,
-            "adults": it.adults,
-            "children": it.children,
-            "transportation": it.transportation,
-            "ageRange": it.age_range,
-            "budget": it.budget,
-            "priorities": it.priorities,
-            "content": it.content,
-            "createdAt": it.created_at.isoformat()
-        }
-        for it in itineraries
-    ]
+@router.get("/user/itineraries", response_model=ItineraryPage)
+def get_user_itineraries(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    query = db.query(*ITINERARY_SUMMARY_COLUMNS).filter(Itinerary.user_id == user_id)
+    rows, next_cursor = keyset_page(query, Itinerary, cursor, limit)
+    page = {"items": [itinerary_summary(it) for it in rows], "next_cursor": next_cursor}
+    return cached_json(request, page, private=True)
+
+@router.get("/itineraries/{itinerary_id}", response_model=ItineraryDetail)
+def get_itinerary(request: Request, itinerary_id: int, user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    it = db.query(Itinerary).filter(Itinerary.id == itinerary_id, Itinerary.user_id == user_id).first()
+    if not it:
+        raise HTTPException(status_code=404, detail="Itinerary not found")
+    return cached_json(request, {**itinerary_summary(it), "content": it.content, "day_plans": itinerary_days(db, it)}, private=True)
 
 @router.delete("/itineraries/{itinerary_id}")
 def delete_itinerary(
     itinerary_id: int,
-    current_user: User = Depends(get_current_user),
+    user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
-    itinerary = db.query(Itinerary).filter(
+    deleted = db.query(Itinerary).filter(
         Itinerary.id == itinerary_id,
-        Itinerary.user_id == current_user["id"]
-    ).first()
+        Itinerary.user_id == user_id
+    ).delete(synchronize_session=False)
 
-    if not itinerary:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Itinerary not found")
+    db.query(ItineraryDay).filter(ItineraryDay.itinerary_id == itinerary_id).delete(synchronize_session=False)
 
-    db.delete(itinerary)
     db.commit()
     return {"detail": "Itinerary deleted successfully"}
 
 @router.post("/save-favorite")
-async def save_favorite(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def save_favorite(request: Request, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
     data = await request.json()
     new_fav = FavoritePlace(
-        user_id=user["id"],
+        user_id=user_id,
         name=data["name"],
         description=data["description"],
         latitude=data["latitude"],
         longitude=data["longitude"],
     )
     db.add(new_fav)
-    db.commit()
-    db.refresh(new_fav)
+    await touch_favorites(db, user_id)
+    await db.commit()
     return {"message": "Favorite saved"}
 
-@router.get("/user/favorites")
-def get_favorites(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(FavoritePlace).filter_by(user_id=user["id"]).order_by(FavoritePlace.created_at.desc()).all()
+def favorite_key(name, latitude, longitude):
+    return (name.strip().lower(), round(float(latitude), 6), round(float(longitude), 6))
+
+def favorites_etag(user_id: int, updated_at: datetime | None):
+    version = updated_at.isoformat() if updated_at else "0"
+    return f'W/"fav-{user_id}-{version}"'
+
+async def touch_favorites(db: AsyncSession, user_id: int):
+    updated_at = datetime.utcnow()
+    await db.execute(update(User).where(User.id == user_id).values(favorites_updated_at=updated_at))
+    return updated_at
+
+@router.post("/user/favorites/sync")
+async def sync_favorites(sync: FavoriteSync, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    """Apply a batch of favorite adds and deletes in one transaction."""
+    deleted = 0
+    if sync.delete:
+        result = await db.execute(
+            delete(FavoritePlace).where(FavoritePlace.user_id == user_id, FavoritePlace.id.in_(sync.delete))
+        )
+        deleted = result.rowcount or 0
+
+    rows = []
+    if sync.add:
+        existing = await db.execute(
+            select(FavoritePlace.name, FavoritePlace.latitude, FavoritePlace.longitude)
+            .where(FavoritePlace.user_id == user_id)
+        )
+        seen = {favorite_key(*row) for row in existing}
+        now = datetime.utcnow()
+        for fav in sync.add:
+            key = favorite_key(fav.name, fav.latitude, fav.longitude)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({
+                "user_id": user_id,
+                "name": fav.name,
+                "description": fav.description,
+                "latitude": fav.latitude,
+                "longitude": fav.longitude,
+                "created_at": now,
+            })
+        if rows:
+            await db.execute(insert(FavoritePlace), rows)
+
+    if deleted or rows:
+        updated_at = await touch_favorites(db, user_id)
+    else:
+        updated_at = await db.scalar(select(User.favorites_updated_at).where(User.id == user_id))
+    await db.commit()
+    return {
+        "added": len(rows),
+        "deleted": deleted,
+        "skipped": len(sync.add) - len(rows),
+        "etag": favorites_etag(user_id, updated_at),
+    }
+
+FAVORITE_COLUMNS = (
+    FavoritePlace.id, FavoritePlace.user_id, FavoritePlace.name, FavoritePlace.description,
+    FavoritePlace.latitude, FavoritePlace.longitude, FavoritePlace.created_at,
+)
+
+@router.get("/user/favorites", response_model=FavoritePage)
+def get_favorites(
+    request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    updated_at = db.query(User.favorites_updated_at).filter(User.id == user_id).scalar()
+    etag = favorites_etag(user_id, updated_at)
+    if cursor or limit != PAGE_SIZE:
+        etag = etag[:-1] + f'-{cursor or ""}-{limit}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control(private=True)}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    query = db.query(*FAVORITE_COLUMNS).filter(FavoritePlace.user_id == user_id)
+    rows, next_cursor = keyset_page(query, FavoritePlace, cursor, limit)
+    response.headers.update(headers)
+    return {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
 
 @router.delete("/favorites/{fav_id}")
-def delete_favorite(fav_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    fav = db.query(FavoritePlace).filter_by(id=fav_id, user_id=user["id"]).first()
-    if fav:
-        db.delete(fav)
+def delete_favorite(fav_id: int, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    deleted = db.query(FavoritePlace).filter_by(id=fav_id, user_id=user_id).delete(synchronize_session=False)
+    if deleted:
+        db.query(User).filter(User.id == user_id).update({"favorites_updated_at": datetime.utcnow()})
         db.commit()
         return {"message": "Favorite deleted"}
     raise HTTPException(status_code=404, detail="Not found")
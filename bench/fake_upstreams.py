@@ -0,0 +1,208 @@
+# bench/fake_upstreams.py
+"""
+Local stand-ins for every third-party API the backend calls, for benchmarks.
+
+Serves OpenAI chat completions (plain and streamed) and embeddings,
+OpenWeather current/forecast, Google Places nearby/details and a static KTEL
+page, all with configurable latency:
+
+    FAKE_LATENCY_MS      latency of weather / places / KTEL responses (default 80)
+    FAKE_LLM_TTFT_MS     time to first token of a chat completion (default 400)
+    FAKE_LLM_TOKEN_MS    delay between streamed tokens (default 15)
+
+Run with: uvicorn bench.fake_upstreams:app --port 8900
+"""
+import os
+import json
+import time
+import asyncio
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
+
+LATENCY = float(os.getenv("FAKE_LATENCY_MS", "80")) / 1000
+LLM_TTFT = float(os.getenv("FAKE_LLM_TTFT_MS", "400")) / 1000
+LLM_TOKEN = float(os.getenv("FAKE_LLM_TOKEN_MS", "15")) / 1000
+
+app = FastAPI()
+
+ITINERARY_DAY = (
+    "### Day {n}: Exploring Paros\n"
+    "- **Morning:** Breakfast by the harbour in Naousa, then a swim at Kolymbithres.\n"
+    "- **Afternoon:** Drive to Lefkes, walk the Byzantine path and have lunch at a taverna.\n"
+    "- **Evening:** Sunset drinks in Parikia and dinner at a seafood restaurant.\n\n"
+)
+REVIEW_JSON = json.dumps({
+    "pros": ["Fresh seafood right by the water", "Friendly, attentive staff"],
+    "cons": ["Busy in August", "Pricier than nearby tavernas"],
+    "rating": 4.5,
+    "summary": "A popular harbour-side spot loved for its seafood and setting.",
+})
+PLACE_NAMES = ["Kolymbithres", "Golden Beach", "Santa Maria", "Monastiri", "Pounta",
+               "Lageri", "Marcello", "Farangas", "Livadia", "Piso Livadi"]
+KTEL_PAGE = """<html><body>
+<h1>KTEL Paros</h1>
+<p>Our buses connect Parikia with every village and the main beaches of Paros, with extra routes during the summer season.</p>
+<h2>Parikia - Naousa (Summer)</h2>
+<table>
+<tr><th>Stop</th><th>1</th><th>2</th><th>3</th><th>4</th></tr>
+<tr><td>Parikia</td><td>08:00</td><td>12:00</td><td>17:30</td><td>19:00</td></tr>
+<tr><td>Kolymbithres</td><td>08:20</td><td>12:20</td><td>17:50</td><td>19:20</td></tr>
+<tr><td>Naousa</td><td>08:30</td><td>12:30</td><td>18:00</td><td>19:30</td></tr>
+</table>
+<h2>Parikia - Lefkes - Piso Livadi (Summer)</h2>
+<table>
+<tr><th>Stop</th><th>1</th><th>2</th></tr>
+<tr><td>Parikia</td><td>09:00</td><td>18:15</td></tr>
+<tr><td>Lefkes</td><td>09:20</td><td>18:35</td></tr>
+<tr><td>Piso Livadi</td><td>09:40</td><td>18:55</td></tr>
+</table>
+</body></html>"""
+
+
+def completion_text(messages):
+    prompt = " ".join(m.get("content") or "" for m in messages).lower()
+    if "### day x" in prompt or "itinerary" in prompt:
+        days = 3
+        for word in prompt.split():
+            if word.startswith("(") and word[1:].isdigit():
+                days = int(word[1:])
+                break
+        return "".join(ITINERARY_DAY.format(n=n) for n in range(1, days + 1))
+    if "json object" in prompt and "pros" in prompt:
+        return REVIEW_JSON
+    if "json object mapping" in prompt:
+        return json.dumps({name: f"A well-loved spot on Paros: {name}." for name in PLACE_NAMES})
+    if "suggest 10 places" in prompt:
+        return "\n".join(f"{name} - A local favourite." for name in PLACE_NAMES)
+    return "Paros is best explored by scooter; the buses from Parikia reach most beaches. " * 3
+
+
+def tokens_of(text):
+    words = text.split(" ")
+    return [w + (" " if i < len(words) - 1 else "") for i, w in enumerate(words)]
+
+
+def usage_for(messages, text):
+    prompt_tokens = sum(len((m.get("content") or "")) for m in messages) // 4
+    completion_tokens = len(text) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "gpt-4o")
+    text = completion_text(messages)
+    created = int(time.time())
+    await asyncio.sleep(LLM_TTFT)
+
+    if not body.get("stream"):
+        await asyncio.sleep(LLM_TOKEN * len(tokens_of(text)))
+        return JSONResponse({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage_for(messages, text),
+        })
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+    async def events():
+        for token in tokens_of(text):
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(LLM_TOKEN)
+        final = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(final)}\n\n"
+        if include_usage:
+            usage = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [], "usage": usage_for(messages, text)}
+            yield f"data: {json.dumps(usage)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body.get("input")
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    await asyncio.sleep(LATENCY)
+    data = []
+    for i, text in enumerate(inputs):
+        rng = random.Random(text)
+        data.append({"object": "embedding", "index": i, "embedding": [rng.uniform(-1, 1) for _ in range(64)]})
+    return {"object": "list", "data": data, "model": body.get("model"),
+            "usage": {"prompt_tokens": 1, "total_tokens": 1}}
+
+
+@app.get("/data/2.5/weather")
+async def weather():
+    await asyncio.sleep(LATENCY)
+    return {"cod": 200, "name": "Paros", "weather": [{"main": "Clear", "description": "clear sky"}],
+            "main": {"temp": 27.3, "humidity": 48}, "wind": {"speed": 6.1}}
+
+
+@app.get("/data/2.5/forecast")
+async def forecast():
+    await asyncio.sleep(LATENCY)
+    now = int(time.time())
+    items = [{"dt": now + i * 10800, "main": {"temp": 24 + (i % 8) * 0.5, "humidity": 50},
+              "weather": [{"main": "Clear", "description": "clear sky"}], "wind": {"speed": 5.0}}
+             for i in range(40)]
+    return {"cod": "200", "cnt": len(items), "list": items, "city": {"name": "Paros", "timezone": 10800}}
+
+
+@app.get("/maps/api/place/nearbysearch/json")
+async def nearby(request: Request):
+    await asyncio.sleep(LATENCY)
+    kind = request.query_params.get("type") or request.query_params.get("keyword") or "place"
+    results = []
+    for i in range(20):
+        results.append({
+            "place_id": f"{kind}-{i}",
+            "name": f"{kind.title()} {i}" if i >= len(PLACE_NAMES) else PLACE_NAMES[i],
+            "vicinity": "Paros",
+            "rating": round(3.5 + (i % 15) / 10, 1),
+            "opening_hours": {"open_now": i % 3 != 0},
+            "geometry": {"location": {"lat": 37.0 + i * 0.007, "lng": 25.1 + i * 0.009}},
+        })
+    return {"status": "OK", "results": results}
+
+
+@app.get("/maps/api/place/details/json")
+async def details(request: Request):
+    await asyncio.sleep(LATENCY)
+    return {"status": "OK", "result": {"formatted_phone_number": "+30 22840 21395"}}
+
+
+KTEL_ETAG = '"ktel-1"'
+KTEL_LAST_MODIFIED = "Mon, 01 Jun 2026 08:00:00 GMT"
+
+
+@app.get("/maps/api/place/findplacefromtext/json")
+async def find_place(request: Request):
+    await asyncio.sleep(LATENCY)
+    name = request.query_params.get("input", "").split(",")[0]
+    return {"status": "OK", "candidates": [{
+        "place_id": f"find-{name}", "name": name.title(), "formatted_address": "Paros 844 00",
+        "opening_hours": {"open_now": len(name) % 2 == 0},
+    }]}
+
+
+@app.get("/ktel/en/index.html")
+async def ktel(request: Request):
+    await asyncio.sleep(LATENCY)
+    headers = {"ETag": KTEL_ETAG, "Last-Modified": KTEL_LAST_MODIFIED}
+    if request.headers.get("if-none-match") == KTEL_ETAG:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(KTEL_PAGE, headers=headers)
@@ -0,0 +1,484 @@
+# bench/run.py
+"""
+Offline load benchmark for the backend.
+
+Starts bench/fake_upstreams.py and `uvicorn main:app` (pointed at the fakes and
+a throwaway SQLite database), drives a weighted mix of /ask, /generate-itinerary,
+/reviews, /map_explorer, weather, quick services and auth traffic from closed-loop
+workers, and reports throughput and p50/p95/p99 latency per route.
+
+    python bench/run.py                              # run, print, write bench/results/latest.json
+    python bench/run.py --save-baseline              # ...and store it as bench/baseline.json
+    python bench/run.py --compare bench/baseline.json
+
+--compare exits with status 1 when any route's p95 or throughput regressed by
+more than --threshold (default 20%).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import asyncio
+import argparse
+import tempfile
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+QUESTIONS = [
+    "How do I get from Parikia to Naousa by bus?",
+    "What are the best beaches for families?",
+    "Where can I rent a scooter?",
+    "Which villages should I visit?",
+    "Where is the best sunset spot?",
+    "Are there buses to Lefkes?",
+    "What should I eat in Paros?",
+    "Is Kolymbithres worth visiting?",
+    "How do I get to Antiparos?",
+    "What is there to do at night in Naousa?",
+    "What's the weather like today?",
+    "Where can I find a pharmacy?",
+]
+REVIEW_PLACES = [
+    ("Barbarossa", "restaurant"), ("Mario", "restaurant"), ("Sommaripa Consolato", "bar"),
+    ("Kolymbithres", "beach"), ("Golden Beach", "beach"), ("Monastiri", "beach"),
+    ("Distrato", "cafe"), ("Pebbles", "bar"), ("Levantis", "restaurant"), ("Thalami", "restaurant"),
+]
+ACTIVITIES = ["beaches", "eating", "drinking", "coffee", "sightseeing", "hiking"]
+SERVICE_TYPES = ["pharmacy", "hospital", "taxi", "gas_station", "atm"]
+
+# route -> relative weight in the traffic mix
+DEFAULT_MIX = {
+    "ask": 20,
+    "ask_stream": 8,
+    "generate_itinerary": 5,
+    "generate_itinerary_stream": 5,
+    "reviews": 12,
+    "map_explorer": 6,
+    "weather_current": 8,
+    "weather_forecast": 4,
+    "quick_services": 8,
+    "bus_next_departures": 4,
+    "me": 8,
+    "user_favorites": 6,
+    "save_favorite": 3,
+    "user_itineraries": 4,
+    "login": 3,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # route -> list of (latency_s, ttfb_s or None, ok)
+        self.recording = False
+
+    def add(self, route, latency, ok, ttfb=None):
+        if self.recording:
+            self.samples.setdefault(route, []).append((latency, ttfb, ok))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def ms(value):
+    return None if value is None else round(value * 1000, 2)
+
+
+def summarize(samples, duration):
+    routes = {}
+    all_latencies = []
+    total_errors = 0
+    for route, rows in sorted(samples.items()):
+        latencies = [r[0] for r in rows]
+        ttfbs = [r[1] for r in rows if r[1] is not None]
+        errors = sum(1 for r in rows if not r[2])
+        all_latencies.extend(latencies)
+        total_errors += errors
+        routes[route] = {
+            "requests": len(rows),
+            "errors": errors,
+            "rps": round(len(rows) / duration, 2),
+            "mean_ms": ms(sum(latencies) / len(latencies)),
+            "p50_ms": ms(percentile(latencies, 50)),
+            "p95_ms": ms(percentile(latencies, 95)),
+            "p99_ms": ms(percentile(latencies, 99)),
+        }
+        if ttfbs:
+            routes[route]["ttfb_p50_ms"] = ms(percentile(ttfbs, 50))
+            routes[route]["ttfb_p95_ms"] = ms(percentile(ttfbs, 95))
+    total = {
+        "requests": len(all_latencies),
+        "errors": total_errors,
+        "rps": round(len(all_latencies) / duration, 2),
+        "p50_ms": ms(percentile(all_latencies, 50)),
+        "p95_ms": ms(percentile(all_latencies, 95)),
+        "p99_ms": ms(percentile(all_latencies, 99)),
+    }
+    return routes, total
+
+
+class Traffic:
+    """One method per route; each returns (ok, ttfb_seconds_or_None)."""
+
+    def __init__(self, client, users):
+        self.client = client
+        self.users = users  # list of (email, password, token)
+
+    def _auth(self):
+        email, password, token = random.choice(self.users)
+        return {"Authorization": f"Bearer {token}"}
+
+    async def _stream(self, method, url, started, **kw):
+        ttfb = None
+        async with self.client.stream(method, url, **kw) as response:
+            async for line in response.aiter_lines():
+                if ttfb is None and line.startswith("data:"):
+                    ttfb = time.perf_counter() - started
+            return response.status_code == 200, ttfb
+
+    async def ask(self, started):
+        r = await self.client.post("/ask", data={"question": random.choice(QUESTIONS)})
+        return r.status_code == 200, None
+
+    async def ask_stream(self, started):
+        return await self._stream("POST", "/ask?stream=true", started, data={"question": random.choice(QUESTIONS)})
+
+    def _itinerary_body(self):
+        return {
+            "days": random.randint(2, 5),
+            "adults": random.randint(1, 4),
+            "children": random.randint(0, 2),
+            "transportation": random.choice(["car", "scooter", "bus"]),
+            "ageRange": random.choice(["20-30", "30-45", "45-60"]),
+            "budget": random.choice(["low", "medium", "high"]),
+            "priorities": random.choice(["beaches", "food", "nightlife", "culture"]),
+        }
+
+    async def generate_itinerary(self, started):
+        r = await self.client.post("/generate-itinerary", json=self._itinerary_body())
+        return r.status_code == 200, None
+
+    async def generate_itinerary_stream(self, started):
+        return await self._stream("POST", "/generate-itinerary?stream=true", started, json=self._itinerary_body())
+
+    async def reviews(self, started):
+        place, type = random.choice(REVIEW_PLACES)
+        r = await self.client.post("/reviews", json={"place": place, "type": type})
+        return r.status_code == 200, None
+
+    async def map_explorer(self, started):
+        r = await self.client.post("/map_explorer", data={"activity": random.choice(ACTIVITIES)})
+        return r.status_code == 200, None
+
+    async def weather_current(self, started):
+        r = await self.client.get("/weather/current")
+        return r.status_code == 200, None
+
+    async def weather_forecast(self, started):
+        r = await self.client.get("/weather/forecast")
+        return r.status_code == 200, None
+
+    async def quick_services(self, started):
+        r = await self.client.get("/quick_services", params={"type": random.choice(SERVICE_TYPES)})
+        return r.status_code == 200, None
+
+    async def bus_next_departures(self, started):
+        params = {"from": "Parikia", "to": random.choice(["Naousa", "Lefkes"]), "after": "08:00", "season": "all"}
+        r = await self.client.get("/bus/next_departures", params=params)
+        return r.status_code == 200, None
+
+    async def me(self, started):
+        r = await self.client.get("/me", headers=self._auth())
+        return r.status_code == 200, None
+
+    async def user_favorites(self, started):
+        r = await self.client.get("/user/favorites", headers=self._auth())
+        return r.status_code == 200, None
+
+    async def save_favorite(self, started):
+        body = {
+            "name": random.choice(REVIEW_PLACES)[0],
+            "description": "Saved by the benchmark",
+            "latitude": 37.08 + random.random() / 10,
+            "longitude": 25.15 + random.random() / 10,
+        }
+        r = await self.client.post("/save-favorite", json=body, headers=self._auth())
+        return r.status_code == 200, None
+
+    async def user_itineraries(self, started):
+        r = await self.client.get("/user/itineraries", headers=self._auth())
+        return r.status_code == 200, None
+
+    async def login(self, started):
+        email, password, _ = random.choice(self.users)
+        r = await self.client.post("/login", data={"username": email, "password": password})
+        return r.status_code == 200, None
+
+
+async def create_users(client, count):
+    users = []
+    run_id = int(time.time())
+    for i in range(count):
+        email = f"bench{run_id}-{i}@example.com"
+        password = f"bench-password-{i}"
+        r = await client.post("/register", json={
+            "name": "Bench", "surname": str(i), "mobile": "6900000000", "email": email, "password": password,
+        })
+        r.raise_for_status()
+        r = await client.post("/login", data={"username": email, "password": password})
+        r.raise_for_status()
+        users.append((email, password, r.json()["access_token"]))
+    return users
+
+
+async def worker(traffic, recorder, routes, weights, deadline):
+    while time.perf_counter() < deadline:
+        route = random.choices(routes, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok, ttfb = await getattr(traffic, route)(started)
+        except httpx.HTTPError:
+            ok, ttfb = False, None
+        recorder.add(route, time.perf_counter() - started, ok, ttfb)
+
+
+async def drive(base_url, args, mix):
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        users = await create_users(client, args.users)
+        traffic = Traffic(client, users)
+        recorder = Recorder()
+        routes = list(mix)
+        weights = [mix[r] for r in routes]
+
+        deadline = time.perf_counter() + args.warmup + args.duration
+        tasks = [asyncio.create_task(worker(traffic, recorder, routes, weights, deadline))
+                 for _ in range(args.concurrency)]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        measured_from = time.perf_counter()
+        await asyncio.gather(*tasks)
+        # Workers finish their in-flight request after the deadline
+        elapsed = time.perf_counter() - measured_from
+    return summarize(recorder.samples, elapsed)
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode} before becoming ready")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def start_process(cmd, env, log_path):
+    log = open(log_path, "w")
+    return subprocess.Popen(cmd, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+
+def stop_process(process):
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGINT)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(routes, total):
+    header = f"{'route':<28}{'reqs':>7}{'err':>6}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ttfb p50':>10}"
+    print(header)
+    print("-" * len(header))
+    for route, s in routes.items():
+        ttfb = s.get("ttfb_p50_ms")
+        print(f"{route:<28}{s['requests']:>7}{s['errors']:>6}{s['rps']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{ttfb if ttfb is not None else '':>10}")
+    print("-" * len(header))
+    print(f"{'total':<28}{total['requests']:>7}{total['errors']:>6}{total['rps']:>8}{total['p50_ms']:>10}"
+          f"{total['p95_ms']:>10}{total['p99_ms']:>10}")
+
+
+def compare(result, baseline, threshold):
+    """Print per-route changes against a baseline; return the list of regressions."""
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['meta'].get('timestamp')} ({baseline['meta'].get('commit')}):")
+    for route, current in result["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before:
+            print(f"  {route:<28} new route")
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            delta = (new - old) / old
+            changes.append(f"{metric} {delta:+.0%}")
+            worse = -delta if metric == "rps" else delta
+            if metric in ("p95_ms", "rps") and worse > threshold:
+                regressions.append(f"{route} {metric}: {old} -> {new}")
+        if current["errors"] > before.get("errors", 0):
+            regressions.append(f"{route} errors: {before.get('errors', 0)} -> {current['errors']}")
+        print(f"  {route:<28} " + ", ".join(changes))
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed-loop workers")
+    parser.add_argument("--users", type=int, default=8, help="accounts registered for auth traffic")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--fake-port", type=int, default=8900)
+    parser.add_argument("--upstream-latency-ms", type=float, default=80)
+    parser.add_argument("--llm-ttft-ms", type=float, default=400)
+    parser.add_argument("--llm-token-ms", type=float, default=15)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--mix", help='JSON object overriding route weights, e.g. \'{"ask": 50, "login": 0}\'')
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app process (repeatable)")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"))
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write the result to {BASELINE_PATH}")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix.update(json.loads(args.mix))
+    mix = {route: weight for route, weight in mix.items() if weight > 0}
+
+    workdir = tempfile.mkdtemp(prefix="parosmate-bench-")
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    fake_env = dict(os.environ)
+    fake_env.update({
+        "FAKE_LATENCY_MS": str(args.upstream_latency_ms),
+        "FAKE_LLM_TTFT_MS": str(args.llm_ttft_ms),
+        "FAKE_LLM_TOKEN_MS": str(args.llm_token_ms),
+    })
+    knowledge_copy = os.path.join(workdir, "paros_knowledge.txt")
+    shutil.copyfile(os.path.join(REPO_DIR, "paros_knowledge.txt"), knowledge_copy)
+    app_env = dict(os.environ)
+    app_env.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "OPENWEATHER_API_KEY": "bench",
+        "OPENWEATHER_URL": f"{fake_url}/data/2.5",
+        "GOOGLE_API_KEY": "bench",
+        "PLACES_URL": f"{fake_url}/maps/api/place",
+        "KTEL_INDEX_URL": f"{fake_url}/ktel/en/index.html",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        # The KTEL ingester rewrites the knowledge file, so give the app its own copy
+        "KNOWLEDGE_PATH": knowledge_copy,
+        # Every bench worker shares one IP; keep per-caller rate limits out of the way
+        # (model concurrency limits stay at their defaults). Override with --app-env.
+        "ADMISSION_RATE_PER_MINUTE": "1000000",
+        "ADMISSION_BURST": "1000000",
+    })
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        app_env[key] = value
+
+    fake = start_process(
+        [sys.executable, "-m", "uvicorn", "bench.fake_upstreams:app", "--port", str(args.fake_port), "--log-level", "warning"],
+        fake_env, os.path.join(workdir, "fake_upstreams.log"),
+    )
+    app = None
+    try:
+        wait_ready(f"{fake_url}/data/2.5/weather", fake)
+        app = start_process(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            app_env, os.path.join(workdir, "app.log"),
+        )
+        wait_ready(f"{base_url}/openapi.json", app)
+        print(f"[INFO] Benchmarking for {args.duration}s with {args.concurrency} workers (logs in {workdir})")
+        routes, total = asyncio.run(drive(base_url, args, mix))
+    finally:
+        if app is not None:
+            stop_process(app)
+        stop_process(fake)
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "concurrency": args.concurrency,
+                "users": args.users,
+                "seed": args.seed,
+                "upstream_latency_ms": args.upstream_latency_ms,
+                "llm_ttft_ms": args.llm_ttft_ms,
+                "llm_token_ms": args.llm_token_ms,
+                "mix": mix,
+                "app_env": args.app_env,
+            },
+        },
+        "routes": routes,
+        "total": total,
+    }
+
+    print_report(routes, total)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n[INFO] Results written to {args.output}")
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"[INFO] Baseline written to {BASELINE_PATH}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# bus_schedule.py
+import os
+import re
+import bisect
+import unicodedata
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Query
+
+from models import SessionLocal, BusDeparture
+
+try:
+    from zoneinfo import ZoneInfo
+    PAROS_TZ = ZoneInfo("Europe/Athens")
+except Exception:  # no tz database: fall back to the server's local time
+    PAROS_TZ = None
+
+router = APIRouter()
+
+# Months (inclusive) in which the summer timetable runs
+SUMMER_START_MONTH = int(os.getenv("KTEL_SUMMER_START_MONTH", "6"))
+SUMMER_END_MONTH = int(os.getenv("KTEL_SUMMER_END_MONTH", "9"))
+MAX_RESULTS = 50
+
+_TIME_RE = re.compile(r"\b([01]?\d|2[0-3])[:.]([0-5]\d)\b")
+
+
+def normalize_stop(name):
+    """Lowercase, accent-free, punctuation-free form used to match stop names."""
+    text = unicodedata.normalize("NFKD", name)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w]", " ", text.lower()).split())
+
+
+def parse_time(value):
+    """Minutes after midnight of the first HH:MM (or HH.MM) in `value`, or None."""
+    match = _TIME_RE.search(value or "")
+    if not match:
+        return None
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def format_minute(minute):
+    return f"{minute // 60 % 24:02d}:{minute % 60:02d}"
+
+
+def paros_now():
+    return datetime.now(PAROS_TZ)
+
+
+def current_season(now=None):
+    month = (now or paros_now()).month
+    return "summer" if SUMMER_START_MONTH <= month <= SUMMER_END_MONTH else "winter"
+
+
+class BusIndex:
+    """
+    Read-only in-memory timetable index.
+
+    `by_stop` keeps every stop's departures sorted by time so "next departures
+    after T" is a bisect; `trips` maps each trip to its stops for destination checks.
+    """
+
+    def __init__(self, rows=()):
+        by_stop = {}
+        self.trips = {}  # (route, season, trip) -> {stop_key: (sequence, minute)}
+        self.names = {}  # stop_key -> stop name as printed in the timetable
+        for route, season, trip, sequence, stop, stop_key, minute in rows:
+            trip_key = (route, season, trip)
+            by_stop.setdefault(stop_key, []).append((minute, sequence, trip_key))
+            self.trips.setdefault(trip_key, {})[stop_key] = (sequence, minute)
+            self.names.setdefault(stop_key, stop)
+        self.by_stop = {}
+        for stop_key, entries in by_stop.items():
+            entries.sort()
+            self.by_stop[stop_key] = ([e[0] for e in entries], entries)
+
+    def __len__(self):
+        return sum(len(minutes) for minutes, _ in self.by_stop.values())
+
+    def resolve(self, name):
+        """Stop keys matching a user-typed name: exact match first, then substring matches."""
+        key = normalize_stop(name)
+        if not key:
+            return []
+        if key in self.by_stop:
+            return [key]
+        return [k for k in self.by_stop if key in k or k in key]
+
+    def next_departures(self, origin, destination=None, after=0, season=None, limit=5):
+        origins = self.resolve(origin)
+        destinations = self.resolve(destination) if destination else None
+        results = []
+        for stop_key in origins:
+            minutes, entries = self.by_stop[stop_key]
+            found = 0
+            for minute, sequence, trip_key in entries[bisect.bisect_left(minutes, after):]:
+                if season and trip_key[1] not in (season, "all"):
+                    continue
+                arrival = None
+                if destinations is None and sequence == len(self.trips[trip_key]) - 1:
+                    continue  # the trip ends here
+                if destinations is not None:
+                    stops = self.trips[trip_key]
+                    arrival = next(
+                        ((k, stops[k][1]) for k in destinations if k in stops and stops[k][0] > sequence),
+                        None,
+                    )
+                    if arrival is None:
+                        continue
+                results.append((minute, {
+                    "route": trip_key[0],
+                    "season": trip_key[1],
+                    "from": self.names[stop_key],
+                    "departure": format_minute(minute),
+                    "to": self.names[arrival[0]] if arrival else None,
+                    "arrival": format_minute(arrival[1]) if arrival else None,
+                }))
+                found += 1
+                if found >= limit:
+                    break
+        results.sort(key=lambda r: r[0])
+        return [departure for _, departure in results[:limit]]
+
+
+_index = BusIndex()
+
+
+def load_index():
+    """Rebuild the in-memory index from the bus_departures table."""
+    global _index
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            BusDeparture.route, BusDeparture.season, BusDeparture.trip, BusDeparture.sequence,
+            BusDeparture.stop, BusDeparture.stop_key, BusDeparture.departure_minute,
+        ).all()
+    finally:
+        db.close()
+    _index = BusIndex(rows)
+    return _index
+
+
+def get_index():
+    return _index
+
+
+@router.get("/bus/next_departures")
+async def next_departures(
+    origin: str = Query(..., alias="from"),
+    destination: str | None = Query(None, alias="to"),
+    after: str | None = Query(None, description="HH:MM, defaults to the current time on Paros"),
+    season: str | None = Query(None, description="summer, winter or all; defaults to today's season"),
+    limit: int = Query(5, ge=1, le=MAX_RESULTS),
+):
+    index = get_index()
+    if not len(index):
+        raise HTTPException(status_code=503, detail="Bus timetable not loaded yet")
+    if not index.resolve(origin):
+        raise HTTPException(status_code=404, detail=f"Unknown stop: {origin}")
+    if destination and not index.resolve(destination):
+        raise HTTPException(status_code=404, detail=f"Unknown stop: {destination}")
+
+    now = paros_now()
+    after_minute = parse_time(after) if after else now.hour * 60 + now.minute
+    if after_minute is None:
+        raise HTTPException(status_code=422, detail="`after` must be HH:MM")
+    season = season or current_season(now)
+    departures = index.next_departures(
+        origin, destination, after=after_minute, season=None if season == "all" else season, limit=limit
+    )
+    return {
+        "from": origin,
+        "to": destination,
+        "after": format_minute(after_minute),
+        "season": season,
+        "departures": departures,
+    }
@@ -0,0 +1,166 @@
+# cache.py
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Named caches, reported by the /metrics endpoint
+caches = {}
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=3600, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            caches[name] = self
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class SQLiteCache:
+    """
+    Cache stored in a SQLite file so several uvicorn workers can share entries.
+
+    Values must be JSON-serialisable. Expired rows are ignored on read and
+    pruned on write. Calls block on file I/O (and on other writers for up to
+    5 s), so call it from async code through run_in_threadpool.
+    """
+
+    def __init__(self, path, table="cache", ttl=3600, name=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        if name:
+            caches[name] = self
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        # set() prunes expired rows on every write
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_expires_at ON {table} (expires_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """Coalesce concurrent async calls for the same key into one in-flight call."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is None:
+            # The call runs in a task owned by the flight, so a caller that goes away
+            # (e.g. its client disconnected) does not cancel it for everyone else
+            task = asyncio.get_running_loop().create_task(func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller had gone away
+            task.exception()
+
+    def in_flight(self, key):
+        return key in self._inflight
+
+
+def build_cache(name, maxsize=1024, ttl=3600):
+    """
+    Build a cache configured from the environment.
+
+    `{NAME}_BACKEND` selects "memory" (default) or "sqlite"; `{NAME}_TTL`,
+    `{NAME}_SIZE` and `{NAME}_PATH` override the defaults.
+    """
+    prefix = name.upper()
+    backend = os.getenv(f"{prefix}_BACKEND", "memory")
+    ttl = float(os.getenv(f"{prefix}_TTL", ttl))
+    if backend == "sqlite":
+        path = os.getenv(f"{prefix}_PATH", "./cache.db")
+        return SQLiteCache(path, table=name.lower(), ttl=ttl, name=name)
+    return TTLCache(maxsize=int(os.getenv(f"{prefix}_SIZE", maxsize)), ttl=ttl, name=name)
@@ -0,0 +1,83 @@
+# compression.py
+import os
+import zlib
+import struct
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+
+try:
+    import zstandard
+except ImportError:  # zlib is used when zstandard isn't installed
+    zstandard = None
+
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "10"))
+ZLIB_LEVEL = 9
+
+# Stored values start with a NUL byte (never the first byte of real text) and a codec tag
+_ZLIB = b"\x00z"
+_ZSTD = b"\x00s"
+_ZSTD_DICT = b"\x00d"  # followed by a 4-byte dictionary id
+
+_dictionaries = {}  # id -> zstandard.ZstdCompressionDict
+_active_dictionary_id = None
+
+
+def register_dictionary(dict_id, data, active=True):
+    """Make a trained zstd dictionary available for decompression (and new writes if active)."""
+    global _active_dictionary_id
+    if zstandard is None:
+        return
+    _dictionaries[dict_id] = zstandard.ZstdCompressionDict(data)
+    if active:
+        _active_dictionary_id = dict_id
+
+
+def train_dictionary(samples, size=32 * 1024):
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+    return zstandard.train_dictionary(size, [s.encode("utf-8") for s in samples]).as_bytes()
+
+
+def compress_text(text):
+    raw = text.encode("utf-8")
+    if zstandard is None:
+        return _ZLIB + zlib.compress(raw, ZLIB_LEVEL)
+    if _active_dictionary_id is not None:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_dictionaries[_active_dictionary_id])
+        return _ZSTD_DICT + struct.pack(">I", _active_dictionary_id) + compressor.compress(raw)
+    return _ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+
+
+def decompress_text(value):
+    if value is None or isinstance(value, str):
+        return value  # legacy row written before compression
+    value = bytes(value)
+    tag = value[:2]
+    if tag == _ZLIB:
+        return zlib.decompress(value[2:]).decode("utf-8")
+    if tag == _ZSTD:
+        return zstandard.ZstdDecompressor().decompress(value[2:]).decode("utf-8")
+    if tag == _ZSTD_DICT:
+        (dict_id,) = struct.unpack(">I", value[2:6])
+        decompressor = zstandard.ZstdDecompressor(dict_data=_dictionaries[dict_id])
+        return decompressor.decompress(value[6:]).decode("utf-8")
+    return value.decode("utf-8")
+
+
+def is_compressed(value):
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:2]) in (_ZLIB, _ZSTD, _ZSTD_DICT)
+
+
+class CompressedText(TypeDecorator):
+    """Text column stored compressed (zstd, or zlib as a fallback); reads plain-text legacy rows too."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
@@ -0,0 +1,56 @@
+# http_cache.py
+import os
+import hashlib
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1000"))
+
+
+def add_compression(app):
+    """Brotli (with gzip fallback) when brotli-asgi is installed, otherwise gzip."""
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        from fastapi.middleware.gzip import GZipMiddleware
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+    else:
+        app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+
+def cache_control(max_age=0, private=False, stale_while_revalidate=None):
+    if private:
+        # Per-user data: browsers may keep it but must revalidate with the ETag
+        return "private, no-cache"
+    value = f"public, max-age={int(max_age)}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={int(stale_while_revalidate)}"
+    return value
+
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip() for tag in header.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+def cached_json(request: Request, content, max_age=0, private=False, stale_while_revalidate=None):
+    """
+    JSON response with a content-hash ETag and Cache-Control header.
+
+    Answers with 304 Not Modified when the client already holds this version.
+    """
+    response = JSONResponse(content=jsonable_encoder(content))
+    etag = 'W/"' + hashlib.sha1(response.body).hexdigest()[:20] + '"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control(max_age, private, stale_while_revalidate),
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
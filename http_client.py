@@ -0,0 +1,135 @@
+# http_client.py
+import time
+import random
+import asyncio
+import importlib.util
+from dataclasses import dataclass
+
+import httpx
+
+from metrics import upstream_call
+
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass(frozen=True)
+class Upstream:
+    timeout: httpx.Timeout
+    retries: int = 2
+    backoff: float = 0.25  # base delay in seconds, doubled per attempt
+    max_backoff: float = 4.0
+
+
+UPSTREAMS = {
+    "openweather": Upstream(timeout=httpx.Timeout(8.0, connect=3.0)),
+    "places": Upstream(timeout=httpx.Timeout(10.0, connect=3.0)),
+    "ktel": Upstream(timeout=httpx.Timeout(15.0, connect=5.0), retries=3, backoff=0.5),
+}
+DEFAULT_UPSTREAM = Upstream(timeout=httpx.Timeout(10.0, connect=5.0))
+
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+HEADERS = {"User-Agent": "parosmate-backend"}
+
+_async_client = None
+_sync_client = None
+
+
+def start():
+    """Create the shared pooled clients. Called from the app lifespan."""
+    global _async_client, _sync_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=LIMITS, headers=HEADERS)
+    if _sync_client is None:
+        _sync_client = httpx.Client(http2=HTTP2_AVAILABLE, limits=LIMITS, headers=HEADERS)
+
+
+async def close():
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+
+
+def get_async_client():
+    if _async_client is None:
+        start()
+    return _async_client
+
+
+def get_sync_client():
+    if _sync_client is None:
+        start()
+    return _sync_client
+
+
+def _delay(config, attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), config.max_backoff)
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(config.max_backoff, config.backoff * (2 ** attempt)))
+
+
+def _should_retry(response):
+    return response.status_code in RETRY_STATUSES
+
+
+async def request(upstream, method, url, **kwargs):
+    """Send a request through the shared async client with the upstream's timeout and retry policy."""
+    config = UPSTREAMS.get(upstream, DEFAULT_UPSTREAM)
+    kwargs.setdefault("timeout", config.timeout)
+    target = httpx.URL(url).path
+    client = get_async_client()
+    for attempt in range(config.retries + 1):
+        last = attempt == config.retries
+        try:
+            with upstream_call(upstream, target) as call:
+                response = await client.request(method, url, **kwargs)
+                if response.status_code >= 500 or response.status_code == 429:
+                    call["error"] = f"http_{response.status_code}"
+        except (httpx.TimeoutException, httpx.TransportError):
+            if last:
+                raise
+            await asyncio.sleep(_delay(config, attempt))
+            continue
+        if last or not _should_retry(response):
+            return response
+        await asyncio.sleep(_delay(config, attempt, response))
+
+
+def request_sync(upstream, method, url, **kwargs):
+    """Blocking variant of request() for code that runs outside the event loop."""
+    config = UPSTREAMS.get(upstream, DEFAULT_UPSTREAM)
+    kwargs.setdefault("timeout", config.timeout)
+    target = httpx.URL(url).path
+    client = get_sync_client()
+    for attempt in range(config.retries + 1):
+        last = attempt == config.retries
+        try:
+            with upstream_call(upstream, target) as call:
+                response = client.request(method, url, **kwargs)
+                if response.status_code >= 500 or response.status_code == 429:
+                    call["error"] = f"http_{response.status_code}"
+        except (httpx.TimeoutException, httpx.TransportError):
+            if last:
+                raise
+            time.sleep(_delay(config, attempt))
+            continue
+        if last or not _should_retry(response):
+            return response
+        time.sleep(_delay(config, attempt, response))
+
+
+async def get(upstream, url, **kwargs):
+    return await request(upstream, "GET", url, **kwargs)
+
+
+def get_sync(upstream, url, **kwargs):
+    return request_sync(upstream, "GET", url, **kwargs)
@@ -0,0 +1,317 @@
+# intents.py
+"""
+Local intent routing for /ask.
+
+Questions that match a rule (or, optionally, the offline-trained linear model)
+are answered directly from weather, Google Places and KTEL data; everything
+else returns None from route_question() and goes to the LLM.
+
+Train the optional model from JSONL lines {"text": ..., "intent": ...}
+(use "none" for questions the LLM should handle):
+
+    python intents.py train intent_examples.jsonl [intent_model.json]
+
+intent_examples.jsonl is a small seed set; extend it from real /ask traffic.
+"""
+import os
+import re
+import sys
+import json
+import math
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+import logs
+from retrieval import tokenize
+from weather import get_paros_weather, get_paros_forecast
+from quick_services import get_places_with_phones, find_place, GOOGLE_API_KEY
+from bus_schedule import get_index as get_bus_index, normalize_stop, parse_time, format_minute, paros_now, current_season
+
+BASE_DIR = Path(__file__).resolve().parent
+INTENT_MODEL_PATH = Path(os.getenv("INTENT_MODEL_PATH", BASE_DIR / "intent_model.json"))
+# Minimum model probability before a question is routed away from the LLM
+INTENT_MODEL_THRESHOLD = float(os.getenv("INTENT_MODEL_THRESHOLD", "0.8"))
+BUS_HUB = "Parikia"  # assumed origin when a question only names a destination
+MAX_SERVICE_RESULTS = 5
+
+# Question keyword -> Google place type
+SERVICE_TYPES = {
+    r"pharmac(y|ies)|chemists?|drug ?stores?": "pharmacy",
+    r"atms?|cash ?machines?|cash ?points?": "atm",
+    r"banks?": "bank",
+    r"hospitals?|clinics?|health cent(er|re)": "hospital",
+    r"doctors?": "doctor",
+    r"police": "police",
+    r"gas ?stations?|petrol|fuel": "gas_station",
+    r"taxis?|cabs?": "taxi_stand",
+    r"supermarkets?|groceries|grocery": "supermarket",
+    r"post ?office": "post_office",
+}
+SERVICE_LABELS = {
+    "pharmacy": "Pharmacies", "atm": "ATMs", "bank": "Banks", "hospital": "Hospitals and clinics",
+    "doctor": "Doctors", "police": "Police stations", "gas_station": "Gas stations",
+    "taxi_stand": "Taxi stands", "supermarket": "Supermarkets", "post_office": "Post offices",
+}
+
+# Keywords alone also appear in ordinary travel questions ("banks of the island",
+# "sheltered from the wind"), so the rules only match phrasings that ask for
+# something here and now; everything else goes to the model and then the LLM.
+_NOW = r"(?:now|right now|today|tonight|tomorrow|currently|at the moment|this (?:morning|afternoon|evening))"
+_SERVICE_WORD_RE = re.compile(r"\b(" + "|".join(SERVICE_TYPES) + r")\b", re.I)
+_SERVICE = r"(?:" + "|".join(SERVICE_TYPES) + r")"
+_SERVICE_RE = re.compile(
+    r"\b(?:nearest|closest|nearby|where(?:'s| is| are| can i find)|find (?:a|an|the)|is there (?:a|an)|are there(?: any)?)"
+    rf"\s+(?:[\w'-]+\s+){{0,3}}?{_SERVICE}\b"
+    rf"|\b{_SERVICE}\s+(?:near me|nearby|open {_NOW})\b",
+    re.I,
+)
+# "Is it open?" names no place to look up
+_VAGUE_PLACE = r"(?:it|this|that|they|there|here|he|she|(?:this |that )?(?:place|shop|store|one))"
+_OPEN_NOW_RE = re.compile(
+    rf"^\s*is\s+(?!(?:the\s+)?{_VAGUE_PLACE}\s+open\b)(?:the\s+)?(?P<name>.+?)\s+open(?:\s+{_NOW})?\s*\??\s*$", re.I
+)
+_BUS_RE = re.compile(r"\b(bus|buses|ktel|coach|timetable|next departures?)\b", re.I)
+_WEATHER_WORDS = r"(?:weather|is it (?:raining|windy|sunny|hot|cold)|will it (?:rain|be windy|be sunny|be hot|be cold))"
+_WEATHER_RE = re.compile(
+    rf"\b{_WEATHER_WORDS}\b.*\b{_NOW}\b|\b{_NOW}\b.*\b{_WEATHER_WORDS}\b|\b(?:weather )?forecast\b", re.I
+)
+_FORECAST_RE = re.compile(r"\b(tomorrow|forecast)\b", re.I)
+_CLOCK_RE = re.compile(r"\b(?P<hour>[01]?\d|2[0-3])(?::(?P<minute>[0-5]\d))?\s*(?P<ampm>am|pm)\b", re.I)
+
+
+@dataclass(frozen=True)
+class Rule:
+    intent: str
+    pattern: re.Pattern
+    handler: object  # async (question, match) -> answer or None
+
+
+rules = []
+handlers = {}
+
+
+def register(intent, pattern=None):
+    """Decorator adding an intent handler, optionally triggered by a regex rule."""
+    def decorator(handler):
+        handlers[intent] = handler
+        if pattern is not None:
+            rules.append(Rule(intent, pattern, handler))
+        return handler
+    return decorator
+
+
+class LinearIntentModel:
+    """Bag-of-words softmax classifier; small enough to evaluate per request in microseconds."""
+
+    def __init__(self, labels, weights, bias):
+        self.labels = labels
+        self.weights = weights  # feature -> [weight per label]
+        self.bias = bias
+
+    @staticmethod
+    def features(text):
+        tokens = tokenize(text)
+        return set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+
+    def predict(self, text):
+        scores = list(self.bias)
+        for feature in self.features(text):
+            row = self.weights.get(feature)
+            if row:
+                scores = [s + w for s, w in zip(scores, row)]
+        top = max(scores)
+        exp = [math.exp(s - top) for s in scores]
+        total = sum(exp)
+        best = max(range(len(exp)), key=exp.__getitem__)
+        return self.labels[best], exp[best] / total
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["labels"], data["weights"], data["bias"])
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"labels": self.labels, "weights": self.weights, "bias": self.bias}, f)
+
+    @classmethod
+    def train(cls, examples, epochs=30, learning_rate=0.5, l2=1e-4, seed=0):
+        """Fit on (text, intent) pairs with plain SGD on the cross-entropy loss."""
+        labels = sorted({intent for _, intent in examples})
+        model = cls(labels, {}, [0.0] * len(labels))
+        data = [(model.features(text), labels.index(intent)) for text, intent in examples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for features, target in data:
+                scores = list(model.bias)
+                for f in features:
+                    row = model.weights.get(f)
+                    if row:
+                        scores = [s + w for s, w in zip(scores, row)]
+                top = max(scores)
+                exp = [math.exp(s - top) for s in scores]
+                total = sum(exp)
+                grads = [e / total - (1.0 if k == target else 0.0) for k, e in enumerate(exp)]
+                model.bias = [b - learning_rate * g for b, g in zip(model.bias, grads)]
+                for f in features:
+                    row = model.weights.setdefault(f, [0.0] * len(labels))
+                    model.weights[f] = [w - learning_rate * (g + l2 * w) for w, g in zip(row, grads)]
+        return model
+
+
+def _load_model():
+    if not INTENT_MODEL_PATH.exists():
+        return None
+    try:
+        return LinearIntentModel.load(INTENT_MODEL_PATH)
+    except (OSError, ValueError, KeyError) as e:
+        logs.warning("intents.model_not_loaded", path=str(INTENT_MODEL_PATH), error=str(e))
+        return None
+
+
+model = _load_model()
+
+
+def classify(question):
+    """Return (intent, match) for the first matching rule, then the model; (None, None) otherwise."""
+    for rule in rules:
+        match = rule.pattern.search(question)
+        if match:
+            return rule.intent, match
+    if model is not None:
+        intent, probability = model.predict(question)
+        if intent in handlers and probability >= INTENT_MODEL_THRESHOLD:
+            return intent, None
+    return None, None
+
+
+async def route_question(question):
+    """Answer `question` locally; returns (intent, answer), or (None, None) to fall through to the LLM."""
+    intent, match = classify(question)
+    if intent is None:
+        return None, None
+    answer = await handlers[intent](question, match)
+    return (intent, answer) if answer else (None, None)
+
+
+def _mentioned_stops(question, names):
+    """Known stops in the question, in order, each with the word right before it."""
+    text = normalize_stop(question)
+    found = []
+    for key in sorted(names, key=len, reverse=True):
+        for m in re.finditer(rf"\b{re.escape(key)}\b", text):
+            if any(start <= m.start() < end for start, end, _, _ in found):
+                continue  # part of a longer stop name already found
+            before = text[:m.start()].split()
+            found.append((m.start(), m.end(), key, before[-1] if before else ""))
+    return sorted(found)
+
+
+def _requested_time(question):
+    minute = parse_time(question)
+    if minute is not None:
+        return minute
+    match = _CLOCK_RE.search(question)
+    if match:
+        hour = int(match.group("hour")) % 12 + (12 if match.group("ampm").lower() == "pm" else 0)
+        return hour * 60 + int(match.group("minute") or 0)
+    now = paros_now()
+    return now.hour * 60 + now.minute
+
+
+@register("open_now", _OPEN_NOW_RE)
+async def answer_open_now(question, match):
+    if match is None or not GOOGLE_API_KEY:
+        return None
+    name = match.group("name").strip(" ?")
+    place = await find_place(name)
+    open_now = (place or {}).get("opening_hours", {}).get("open_now")
+    if open_now is None:
+        return None
+    label = place.get("name") or name
+    address = f" ({place['formatted_address']})" if place.get("formatted_address") else ""
+    state = "open right now" if open_now else "closed right now"
+    return f"{label}{address} is {state}, according to Google Maps."
+
+
+@register("bus", _BUS_RE)
+async def answer_bus(question, match):
+    index = get_bus_index()
+    if not len(index):
+        return None
+    stops = _mentioned_stops(question, index.names)
+    if not stops:
+        return None
+    origin = next((key for _, _, key, before in stops if before == "from"), None)
+    destination = next((key for _, _, key, before in stops if before in ("to", "for") and key != origin), None)
+    others = [key for _, _, key, _ in stops if key not in (origin, destination)]
+    if origin is None:
+        origin = others.pop(0) if others and (destination or len(others) > 1) else normalize_stop(BUS_HUB)
+    if destination is None and others:
+        destination = others.pop(0)
+    if origin == destination:
+        destination = None
+
+    after = _requested_time(question)
+    season = current_season()
+    departures = index.next_departures(origin, destination, after=after, season=season, limit=3)
+    route = f"from {index.names.get(origin, BUS_HUB)}" + (f" to {index.names[destination]}" if destination else "")
+    if not departures:
+        first = index.next_departures(origin, destination, after=0, season=season, limit=1)
+        if not first:
+            return None
+        return (f"There are no more buses {route} after {format_minute(after)} today. "
+                f"The first one tomorrow leaves at {first[0]['departure']}.")
+    times = ", ".join(
+        d["departure"] + (f" (arrives {d['arrival']})" if d["arrival"] else "") for d in departures
+    )
+    return (f"Next buses {route} after {format_minute(after)}: {times}. "
+            "Times are from the KTEL timetable; check https://ktelparou.gr/en for last-minute changes.")
+
+
+@register("services", _SERVICE_RE)
+async def answer_services(question, match):
+    if not GOOGLE_API_KEY:
+        return None
+    word = _SERVICE_WORD_RE.search(match.group(0)) if match else None
+    keyword = word.group(1) if word else None
+    type = next((t for pattern, t in SERVICE_TYPES.items() if keyword and re.fullmatch(pattern, keyword, re.I)), None)
+    if type is None:
+        return None
+    places = await get_places_with_phones(type)
+    if re.search(r"\bopen\b", question, re.I):
+        places = [p for p in places if p["open_now"]]
+    if not places:
+        return None
+    lines = [f"{SERVICE_LABELS[type]} on Paros:"]
+    for place in places[:MAX_SERVICE_RESULTS]:
+        details = [place["address"]] if place["address"] else []
+        if place["phone"]:
+            details.append(place["phone"])
+        if place["open_now"] is not None:
+            details.append("open now" if place["open_now"] else "closed now")
+        lines.append(f"- {place['name']}" + (f" ({', '.join(details)})" if details else ""))
+    return "\n".join(lines)
+
+
+@register("weather", _WEATHER_RE)
+async def answer_weather(question, match):
+    if _FORECAST_RE.search(question):
+        return await get_paros_forecast()
+    return await get_paros_weather()
+
+
+if __name__ == "__main__":
+    # python intents.py train examples.jsonl [intent_model.json]
+    if len(sys.argv) < 3 or sys.argv[1] != "train":
+        sys.exit(__doc__)
+    with open(sys.argv[2], "r", encoding="utf-8") as f:
+        examples = [(row["text"], row["intent"]) for row in map(json.loads, f) if row.get("text")]
+    trained = LinearIntentModel.train(examples)
+    out = sys.argv[3] if len(sys.argv) > 3 else INTENT_MODEL_PATH
+    trained.save(out)
+    correct = sum(trained.predict(text)[0] == intent for text, intent in examples)
+    print(f"[INFO] Trained intent model on {len(examples)} examples ({correct / len(examples):.0%} train accuracy), saved to {out}")
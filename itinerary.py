@@ -0,0 +1,254 @@
+# itinerary.py
+import re
+from datetime import datetime, timedelta
+from pydantic import BaseModel
+from sqlalchemy.orm import undefer
+
+from prompts import PromptBuilder
+from models import SessionLocal, Itinerary, ItineraryDay
+
+ITINERARY_MODEL = "gpt-4o"
+
+# "### Day 2: Beaches of the south" (the prompt asks for this; bold or other heading levels are tolerated)
+_DAY_HEADING_RE = re.compile(r"^#{1,4}[ \t]*\**[ \t]*Day[ \t]+(\d+)\b\**[ \t]*[:.\-–—]?[ \t]*(.*?)[ \t*]*$", re.M | re.I)
+# "- **Morning:** ...", "**Afternoon**", "#### Evening" ...
+_SLOT_RE = re.compile(
+    r"^\s*(?:[-*]\s+)?(?:#+\s*)?\**\s*(morning|afternoon|evening)\s*\**\s*(?:[:\-–—]\s*\**\s*(.*)|$)", re.I
+)
+
+
+class ItineraryRequest(BaseModel):
+    days: int
+    adults: int
+    children: int
+    transportation: str
+    ageRange: str
+    budget: str
+    priorities: str
+
+
+ITINERARY_INSTRUCTIONS = (
+    "You are a friendly, hyper-local AI travel concierge named ParosMate. "
+    "Only suggest real places and experiences in Paros, Greece. "
+    "Be concise and practical, but fun and local. "
+    "Suggest hidden gems. Always include activities for Morning / Afternoon / Evening. "
+    "Do NOT include generic tips or recommendations outside Paros.\n\n"
+    "From the trip details you are given, infer the most appropriate holiday type and mood. "
+    "Then generate a fully customized, engaging, day-by-day itinerary. "
+    "Each day must include a **morning**, **afternoon**, and **evening** suggestion, with a mix of sightseeing, activities, relaxation, and food options. "
+    "Be mindful if the group includes children, or if the age group suggests nightlife. "
+    "Start each day title with: ### Day X:"
+)
+
+
+def trip_details(request: ItineraryRequest, start=None):
+    total_people = request.adults + request.children
+
+    # Estimate arrival/departure dates
+    start = start or datetime.today()
+    arrival = start.strftime("%Y-%m-%d")
+    departure = (start + timedelta(days=request.days)).strftime("%Y-%m-%d")
+
+    return (
+        f"Create a travel itinerary for a group of {total_people} people staying in Paros, Greece, "
+        f"from {arrival} to {departure} ({request.days} days). "
+        f"They are traveling with {request.adults} adult(s) and {request.children} child(ren). "
+        f"The average age range is {request.ageRange}. "
+        f"Their transportation method is: {request.transportation}. "
+        f"Their budget is {request.budget}. "
+        f"Their interests or special preferences are: {request.priorities}."
+    )
+
+
+def build_itinerary_messages(request: ItineraryRequest):
+    # Only the trip details vary; the instructions are the same for every request
+    return PromptBuilder("itinerary", ITINERARY_MODEL).system(ITINERARY_INSTRUCTIONS).user(trip_details(request)).build()
+
+
+def build_day_messages(request: ItineraryRequest, days, number, start=None, instructions=""):
+    """Messages that rewrite day `number` only, with the rest of the itinerary as context."""
+    others = []
+    for day in days:
+        if day["day"] == number:
+            continue
+        # Neighbouring days in full (for pacing and travel), the rest by their titles
+        if abs(day["day"] - number) == 1:
+            others.append(day["content"])
+        else:
+            others.append(f"### Day {day['day']}: {day['title']}")
+    prompt = (
+        f"{trip_details(request, start)}\n\n"
+        f"Rewrite only Day {number} of this itinerary. Keep it consistent with the other days "
+        f"and do not repeat their places. Start it with: ### Day {number}:"
+    )
+    if instructions:
+        prompt += f"\nThe traveller asked for: {instructions}"
+    return (
+        PromptBuilder("itinerary_day", ITINERARY_MODEL)
+        .system(ITINERARY_INSTRUCTIONS)
+        .context("The other days of this itinerary", "\n\n".join(others))
+        .user(prompt)
+        .build()
+    )
+
+
+def parse_day(section):
+    """Structured record for one `### Day N:` markdown section."""
+    heading = _DAY_HEADING_RE.match(section)
+    slots = {"morning": [], "afternoon": [], "evening": []}
+    current = None
+    for line in section[heading.end():].splitlines() if heading else section.splitlines():
+        match = _SLOT_RE.match(line)
+        if match:
+            current = match.group(1).lower()
+            line = match.group(2) or ""
+        if current is not None and line.strip():
+            slots[current].append(line.strip())
+    return {
+        "day": int(heading.group(1)) if heading else None,
+        "title": heading.group(2).strip() if heading else "",
+        **{slot: "\n".join(lines) for slot, lines in slots.items()},
+        "content": section.strip(),
+    }
+
+
+def parse_itinerary(text):
+    """Split a generated itinerary on its `### Day N:` headings into day records."""
+    starts = [m.start() for m in _DAY_HEADING_RE.finditer(text or "")]
+    return [parse_day(text[a:b]) for a, b in zip(starts, starts[1:] + [len(text)])]
+
+
+class DayParser:
+    """
+    Parse an itinerary while it streams: feed() returns the days closed by a
+    new heading in that token, close() the last one. All days end up in `days`.
+    """
+
+    def __init__(self):
+        self.days = []
+        self._text = ""
+        self._scanned = 0  # end of the last complete line looked at
+        self._current = None  # start of the open day's heading
+
+    def _close_day(self, end):
+        day = parse_day(self._text[self._current:end])
+        self.days.append(day)
+        return day
+
+    def feed(self, token):
+        self._text += token
+        end = self._text.rfind("\n") + 1
+        if end <= self._scanned:
+            return []
+        closed = []
+        # Headings are only matched on complete lines, so a split "### Da" + "y 2:" is still found
+        for match in _DAY_HEADING_RE.finditer(self._text, self._scanned, end):
+            if self._current is not None:
+                closed.append(self._close_day(match.start()))
+            self._current = match.start()
+        self._scanned = end
+        return closed
+
+    def close(self):
+        # A heading on the unterminated last line still counts
+        for match in _DAY_HEADING_RE.finditer(self._text, self._scanned):
+            if self._current is not None:
+                self._close_day(match.start())
+            self._current = match.start()
+        self._scanned = len(self._text)
+        if self._current is None:
+            return None
+        day = self._close_day(len(self._text))
+        self._current = None
+        return day
+
+
+def replace_day_section(content, number, section):
+    """Swap day `number`'s section in the itinerary markdown (appending it if missing)."""
+    days = parse_itinerary(content)
+    if not any(day["day"] == number for day in days):
+        return (content or "").rstrip() + "\n\n" + section.strip() + "\n"
+    starts = [m.start() for m in _DAY_HEADING_RE.finditer(content)]
+    parts = [content[:starts[0]]]
+    for day, (a, b) in zip(days, zip(starts, starts[1:] + [len(content)])):
+        trailing = content[a:b][len(content[a:b].rstrip()):]
+        parts.append((section.strip() + trailing) if day["day"] == number else content[a:b])
+    return "".join(parts)
+
+
+def _day_to_dict(row):
+    return {**parse_day(row.content or ""), "day": row.day, "title": row.title}
+
+
+def itinerary_days(db, itinerary):
+    """Stored day records, or days parsed from the content for itineraries saved before they existed."""
+    rows = (
+        db.query(ItineraryDay)
+        .options(undefer(ItineraryDay.content))
+        .filter(ItineraryDay.itinerary_id == itinerary.id)
+        .order_by(ItineraryDay.day)
+        .all()
+    )
+    if rows:
+        return [_day_to_dict(row) for row in rows]
+    return parse_itinerary(itinerary.content)
+
+
+def store_days(db, itinerary_id, days):
+    """Replace an itinerary's day rows; the caller commits."""
+    db.query(ItineraryDay).filter(ItineraryDay.itinerary_id == itinerary_id).delete(synchronize_session=False)
+    seen = set()
+    for day in days:
+        if day["day"] is None or day["day"] in seen:
+            continue
+        seen.add(day["day"])
+        db.add(ItineraryDay(itinerary_id=itinerary_id, day=day["day"], title=day["title"], content=day["content"]))
+
+
+def load_trip(itinerary_id, user_id):
+    """(request, start, days) for one of the user's itineraries, or None if it isn't theirs."""
+    db = SessionLocal()
+    try:
+        it = db.query(Itinerary).filter(Itinerary.id == itinerary_id, Itinerary.user_id == user_id).first()
+        if it is None:
+            return None
+        days = itinerary_days(db, it)
+        request = ItineraryRequest(
+            days=it.days or len(days), adults=it.adults or 0, children=it.children or 0,
+            transportation=it.transportation or "", ageRange=it.age_range or "",
+            budget=it.budget or "", priorities=it.priorities or "",
+        )
+        return request, it.created_at, days
+    finally:
+        db.close()
+
+
+def save_day(itinerary_id, number, text):
+    """Store a regenerated day, in its day row and in the itinerary's markdown; returns the day record."""
+    days = [day for day in parse_itinerary(text) if day["day"] in (number, None)] or parse_itinerary(text)
+    section = days[0]["content"] if days else f"### Day {number}:\n{text.strip()}"
+    # The model may renumber the day; the heading always names the day that was asked for
+    section = _DAY_HEADING_RE.sub(lambda m: m.group(0).replace(m.group(1), str(number), 1), section, count=1)
+    day = parse_day(section)
+
+    db = SessionLocal()
+    try:
+        it = db.get(Itinerary, itinerary_id)
+        if it is None:
+            return day  # deleted while the day was being generated
+        if not db.query(ItineraryDay.id).filter(ItineraryDay.itinerary_id == itinerary_id).first():
+            store_days(db, itinerary_id, parse_itinerary(it.content))
+            db.flush()
+        it.content = replace_day_section(it.content or "", number, section)
+        row = db.query(ItineraryDay).filter(
+            ItineraryDay.itinerary_id == itinerary_id, ItineraryDay.day == number
+        ).first()
+        if row is None:
+            row = ItineraryDay(itinerary_id=itinerary_id, day=number)
+            db.add(row)
+        row.title, row.content = day["title"], day["content"]
+        row.updated_at = datetime.utcnow()
+        db.commit()
+        return day
+    finally:
+        db.close()
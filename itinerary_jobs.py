@@ -0,0 +1,214 @@
+# itinerary_jobs.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+import logs
+from models import SessionLocal, ItineraryJob
+from itinerary import ItineraryRequest, ITINERARY_MODEL, build_itinerary_messages, parse_itinerary
+from llm import stream_tokens
+import admission
+
+router = APIRouter()
+
+ITINERARY_WORKERS = int(os.getenv("ITINERARY_WORKERS", "2"))
+ITINERARY_QUEUE_SIZE = int(os.getenv("ITINERARY_QUEUE_SIZE", "100"))
+# How often (seconds) partial output of a running job is written to the database
+PARTIAL_FLUSH_INTERVAL = 1.0
+# Running jobs not updated for this long are assumed orphaned by a dead worker
+STALE_RUNNING_AFTER = timedelta(minutes=2)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_queue = None
+_workers = []
+_partials = {}  # job id -> token list, for jobs running in this process
+_submit_lock = asyncio.Lock()
+
+
+def request_key(request: ItineraryRequest):
+    normalized = {
+        key: " ".join(value.lower().split()) if isinstance(value, str) else value
+        for key, value in request.model_dump().items()
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _job_to_dict(job, partial=None):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "partial": partial if partial is not None else (job.partial or ""),
+        "itinerary": job.result,
+        "day_plans": parse_itinerary(job.result) if job.result else [],
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+def _find_active(key):
+    db = SessionLocal()
+    try:
+        job = db.query(ItineraryJob).filter(
+            ItineraryJob.request_key == key,
+            ItineraryJob.status.in_(ACTIVE_STATUSES),
+        ).order_by(ItineraryJob.created_at.desc()).first()
+        return (job.id, job.status) if job else None
+    finally:
+        db.close()
+
+
+def _create_job(key, request_json):
+    db = SessionLocal()
+    try:
+        job = ItineraryJob(id=uuid.uuid4().hex, request_key=key, request_json=request_json, status="queued")
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def _claim_job(job_id):
+    """Atomically move a queued job to running and return its request JSON (None if already claimed)."""
+    db = SessionLocal()
+    try:
+        claimed = db.query(ItineraryJob).filter(
+            ItineraryJob.id == job_id,
+            ItineraryJob.status == "queued",
+        ).update({"status": "running", "updated_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return None
+        return db.query(ItineraryJob.request_json).filter(ItineraryJob.id == job_id).scalar()
+    finally:
+        db.close()
+
+
+def _update_job(job_id, **fields):
+    db = SessionLocal()
+    try:
+        fields["updated_at"] = datetime.utcnow()
+        db.query(ItineraryJob).filter(ItineraryJob.id == job_id).update(fields, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _load_job(job_id):
+    db = SessionLocal()
+    try:
+        job = db.query(ItineraryJob).filter(ItineraryJob.id == job_id).first()
+        return _job_to_dict(job, partial="".join(_partials[job_id]) if job_id in _partials else None) if job else None
+    finally:
+        db.close()
+
+
+def _recoverable_jobs():
+    """Jobs left queued, or running with no recent progress, by a previous process."""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - STALE_RUNNING_AFTER
+        db.query(ItineraryJob).filter(
+            ItineraryJob.status == "running",
+            ItineraryJob.updated_at < cutoff,
+        ).update({"status": "queued", "partial": None}, synchronize_session=False)
+        db.commit()
+        return [job_id for (job_id,) in db.query(ItineraryJob.id).filter(ItineraryJob.status == "queued")
+                .order_by(ItineraryJob.created_at)]
+    finally:
+        db.close()
+
+
+async def _run_job(job_id):
+    request_json = await run_in_threadpool(_claim_job, job_id)
+    if request_json is None:
+        return
+
+    request = ItineraryRequest(**json.loads(request_json))
+    tokens = _partials[job_id] = []
+    last_flush = time.monotonic()
+    try:
+        messages = build_itinerary_messages(request)
+        # Jobs share the model's concurrency limit with the direct endpoints but never time out waiting
+        slot = await admission.acquire(ITINERARY_MODEL, timeout=None)
+        async for token in slot.guard(stream_tokens(ITINERARY_MODEL, messages)):
+            tokens.append(token)
+            if time.monotonic() - last_flush >= PARTIAL_FLUSH_INTERVAL:
+                last_flush = time.monotonic()
+                await run_in_threadpool(_update_job, job_id, partial="".join(tokens))
+        text = "".join(tokens)
+        await run_in_threadpool(_update_job, job_id, status="done", partial=text, result=text)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so the next start picks it up again
+        _update_job(job_id, status="queued", partial=None)
+        raise
+    except Exception as e:
+        logs.error("itinerary_jobs.job_failed", job_id=job_id, error=str(e))
+        await run_in_threadpool(_update_job, job_id, status="failed", partial="".join(tokens), error=str(e))
+    finally:
+        _partials.pop(job_id, None)
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _run_job(job_id)
+        except Exception as e:
+            logs.error("itinerary_jobs.worker_error", job_id=job_id, error=str(e))
+        finally:
+            _queue.task_done()
+
+
+async def start_workers():
+    global _queue
+    _queue = asyncio.Queue(maxsize=ITINERARY_QUEUE_SIZE)
+    for job_id in await run_in_threadpool(_recoverable_jobs):
+        if _queue.full():
+            break
+        _queue.put_nowait(job_id)
+    for _ in range(ITINERARY_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+@router.post("/itineraries/jobs", status_code=202)
+async def submit_itinerary_job(request: ItineraryRequest, http_request: Request):
+    key = request_key(request)
+    async with _submit_lock:
+        existing = await run_in_threadpool(_find_active, key)
+        if existing:
+            job_id, status = existing
+            return {"job_id": job_id, "status": status, "deduplicated": True}
+
+        # Joining an existing job is free; starting a new one counts against the caller's rate
+        admission.check_rate(http_request, ITINERARY_MODEL)
+        if _queue is None or _queue.full():
+            raise HTTPException(status_code=503, detail="Itinerary queue is full, try again shortly")
+
+        job_id = await run_in_threadpool(_create_job, key, request.model_dump_json())
+        _queue.put_nowait(job_id)
+    return {"job_id": job_id, "status": "queued", "deduplicated": False}
+
+
+@router.get("/itineraries/jobs/{job_id}")
+async def get_itinerary_job(job_id: str):
+    job = await run_in_threadpool(_load_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
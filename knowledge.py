@@ -0,0 +1,73 @@
+# knowledge.py
+import os
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import logs
+
+BASE_DIR = Path(__file__).resolve().parent
+KNOWLEDGE_PATH = Path(os.getenv("KNOWLEDGE_PATH", BASE_DIR / "paros_knowledge.txt"))
+# How often (seconds) get_knowledge() is allowed to stat the file for changes
+KNOWLEDGE_CHECK_INTERVAL = float(os.getenv("KNOWLEDGE_CHECK_INTERVAL", "5"))
+
+
+@dataclass(frozen=True)
+class KnowledgeBase:
+    text: str
+    version: str  # short content hash, stable across restarts
+    mtime: float
+
+
+_current = KnowledgeBase(text="", version="empty", mtime=0.0)
+_last_check = 0.0
+_lock = threading.Lock()
+
+
+def load_knowledge(path=KNOWLEDGE_PATH):
+    try:
+        mtime = os.stat(path).st_mtime
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except FileNotFoundError:
+        logs.warning("knowledge.file_missing", path=str(path))
+        return KnowledgeBase(text="", version="missing", mtime=0.0)
+
+    version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return KnowledgeBase(text=text, version=version, mtime=mtime)
+
+
+def reload_knowledge():
+    """Force a reload from disk, e.g. after the bus scraper rewrote the file."""
+    global _current, _last_check
+    with _lock:
+        kb = load_knowledge()
+        if kb.version != _current.version:
+            logs.info("knowledge.loaded", version=kb.version, chars=len(kb.text))
+        _current = kb
+        _last_check = time.monotonic()
+        return kb
+
+
+def get_knowledge():
+    """
+    Return the in-memory knowledge base.
+
+    The file is only stat'ed once per KNOWLEDGE_CHECK_INTERVAL and only re-read
+    when its mtime has changed.
+    """
+    global _last_check
+    now = time.monotonic()
+    if now - _last_check < KNOWLEDGE_CHECK_INTERVAL:
+        return _current
+
+    _last_check = now
+    try:
+        mtime = os.stat(KNOWLEDGE_PATH).st_mtime
+    except FileNotFoundError:
+        mtime = 0.0
+    if mtime != _current.mtime:
+        return reload_knowledge()
+    return _current
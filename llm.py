@@ -0,0 +1,93 @@
+# llm.py
+import os
+import json
+import time
+import inspect
+from openai import AsyncOpenAI
+from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+import logs
+from metrics import upstream_call, record_usage, LLM_TIME_TO_FIRST_TOKEN
+
+load_dotenv()
+
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+async def complete(model, messages, **kwargs):
+    """Run a chat completion without blocking the event loop and return the text."""
+    with upstream_call("openai", model):
+        response = await client.chat.completions.create(model=model, messages=messages, **kwargs)
+    record_usage(model, response.usage)
+    return response.choices[0].message.content or ""
+
+
+async def stream_tokens(model, messages, **kwargs):
+    """Yield content deltas from a streamed chat completion as they arrive."""
+    with upstream_call("openai", model):
+        started = time.perf_counter()
+        first = True
+        stream = await client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        async for chunk in stream:
+            # With include_usage the last chunk has no choices, only the token counts
+            if getattr(chunk, "usage", None) is not None:
+                record_usage(model, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first:
+                    LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, model=model)
+                    first = False
+                yield delta
+
+
+async def single_token(text):
+    """Replay an already known answer (e.g. from a cache) through the streaming path."""
+    yield text
+
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(tokens, on_done=None, on_token=None):
+    """
+    Wrap a token iterator in a Server-Sent-Events response.
+
+    Every token is sent as a `data: {"token": ...}` message, followed by any
+    (event, data) pairs `on_token(token)` returns. When the stream ends a final
+    `done` event is sent with `on_done(full_text)` (or the full text itself);
+    `on_done` may be async, e.g. to save the result off the event loop.
+    """
+    async def event_stream():
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event({"token": token})
+                for event, data in (on_token(token) if on_token else ()):
+                    yield sse_event(data, event=event)
+        except Exception as e:
+            logs.error("llm.stream_failed", error=str(e))
+            yield sse_event({"detail": "Upstream model error"}, event="error")
+            return
+
+        text = "".join(parts)
+        try:
+            payload = on_done(text) if on_done else {"text": text}
+            if inspect.isawaitable(payload):
+                payload = await payload
+        except Exception as e:
+            logs.error("llm.stream_finalize_failed", error=str(e))
+            payload = {"text": text}
+        yield sse_event(payload, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
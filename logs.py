@@ -0,0 +1,48 @@
+# logs.py
+import os
+import json
+import time
+import random
+import logging
+
+# DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of debug events written when debug logging is on; warnings and errors are never sampled
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+logger = logging.getLogger("parosmate")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+
+
+def log(level, event, sample_rate=1.0, **fields):
+    """Write one JSON log line: {"ts", "level", "event", **fields}."""
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level).lower(), "event": event}
+    if sample_rate < 1.0:
+        record["sample_rate"] = sample_rate
+    record.update(fields)
+    logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+
+def debug(event, **fields):
+    log(logging.DEBUG, event, LOG_SAMPLE_RATE, **fields)
+
+
+def info(event, **fields):
+    log(logging.INFO, event, **fields)
+
+
+def warning(event, **fields):
+    log(logging.WARNING, event, **fields)
+
+
+def error(event, **fields):
+    log(logging.ERROR, event, **fields)
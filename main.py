@@ -1,271 +1,347 @@
-from fastapi import FastAPI, UploadFile, File, Form, APIRouter, HTTPException
-from auth import router as auth_router
+from fastapi import FastAPI, UploadFile, File, Form, APIRouter, HTTPException, Request, Depends, Query as QueryParam
+from fastapi.concurrency import run_in_threadpool
+from auth import router as auth_router, get_current_user_id
 from pydantic import BaseModel
 import os
-import requests
-from openai import OpenAI
+import json
+import re
+import hashlib
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from scrape_ktel import update_knowledge_file_basic_summary
+from llm import client, complete, stream_tokens, single_token, sse_response
+from knowledge import get_knowledge, reload_knowledge
+from retrieval import retrieve, format_chunks, get_index, RETRIEVAL_TOKEN_BUDGET
+from prompts import PromptBuilder, PROMPT_UPLOAD_TOKENS
+from cache import build_cache
+from review_store import get_or_create_summary
+import scrape_ktel
+import bus_schedule
+from intents import route_question
+import uploads
+import admission
 from quick_services import router as quick_services_router
-from pathlib import Path
-from datetime import datetime, timedelta
+from weather import router as weather_router, start_refresher, stop_refresher
+import http_client
+import password_hashing
+from models import init_db, dispose_engines
+from http_cache import add_compression
+from itinerary import (
+    ItineraryRequest, ITINERARY_MODEL, DayParser, build_itinerary_messages, build_day_messages,
+    parse_itinerary, load_trip, save_day,
+)
+import itinerary_jobs
+import place_catalog
+import logs
+import metrics
+from place_catalog import query_places, schedule_refresh
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 router = APIRouter()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    http_client.start()
+    password_hashing.start()
+    reload_knowledge()
+    get_index()
+    start_refresher()
+    await itinerary_jobs.start_workers()
+    place_catalog.start_refresher()
+    bus_schedule.load_index()
+    scrape_ktel.start_ingester()
+    yield
+    await scrape_ktel.stop_ingester()
+    await place_catalog.stop_refresher()
+    await itinerary_jobs.stop_workers()
+    await stop_refresher()
+    await client.close()
+    await http_client.close()
+    password_hashing.shutdown()
+    uploads.shutdown()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(quick_services_router)
 app.include_router(auth_router)
+app.include_router(weather_router)
+app.include_router(itinerary_jobs.router)
+app.include_router(metrics.router)
+app.include_router(bus_schedule.router)
+# Innermost, so 413 responses still get CORS headers
+app.add_middleware(uploads.UploadLimitMiddleware, paths=["/ask"])
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://parosmate.netlify.app"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
+add_compression(app)
+# Outermost, so route latency includes compression and the full streamed body
+app.add_middleware(metrics.MetricsMiddleware)
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 PAROS_LAT = 37.0853
 PAROS_LNG = 25.1500
 
-def get_paros_weather():
-    api_key = os.getenv("OPENWEATHER_API_KEY")  # Make sure it's in your .env file
-    url = f"https://api.openweathermap.org/data/2.5/weather?q=Paros,GR&appid={api_key}&units=metric"
-    try:
-        response = requests.get(url)
-        data = response.json()
-        if data.get("cod") != 200:
-            return None
-        weather = data["weather"][0]["description"].capitalize()
-        temp = data["main"]["temp"]
-        return f"The current weather in Paros is {weather} with a temperature of {temp}°C."
-    except Exception as e:
-        return "Weather information is currently unavailable."
-
-
 class Query(BaseModel):
     question: str
 
+# Answers keyed on (normalized question, upload hash, knowledge version)
+answer_cache = build_cache("answer_cache", maxsize=2048, ttl=6 * 3600)
+
+def normalize_question(question):
+    text = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(text.split())
+
+def answer_cache_key(question, file_hash, knowledge_version):
+    raw = f"{normalize_question(question)}|{file_hash}|{knowledge_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def cache_info(hit):
+    stats = answer_cache.stats()
+    return {"hit": hit, "hits": stats["hits"], "misses": stats["misses"]}
+
+ASK_MODEL = "gpt-3.5-turbo"
+ASK_INSTRUCTIONS = (
+    "You are a friendly, hyper-local, expert travel assistant named ParosGPT for the island of Paros, Greece. "
+    "Always answer based on the Paros knowledge base provided below. "
+    "Use a fun but professional tone. "
+    "If the provided content doesn't include the answer, you may use general knowledge."
+)
+
 @app.post("/ask")
-async def ask_question(question: str = Form(...), file: UploadFile = File(None)):
-    print(f"Received question: {question}")
+async def ask_question(
+    question: str = Form(...),
+    file: UploadFile = File(None),
+    stream: bool = QueryParam(False),
+):
+    logs.debug("ask.received", question=question[:200], has_file=file is not None, stream=stream)
     file_text = ""
+    file_hash = ""
 
     if file:
-        contents = await file.read()
-        print(f"Received file: {file.filename}, size: {len(contents)} bytes")
-        file_text = contents.decode("utf-8", errors="ignore")[:1000]  # limit for prompt
-
-        # Optional: Save the file for debugging
-        with open(f"uploaded_{file.filename}", "wb") as f:
-            f.write(contents)
-
-    try:
-        BASE_DIR = Path(__file__).resolve().parent
-        KNOWLEDGE_PATH = BASE_DIR / "paros_knowledge.txt"
-
-        print(f"🟡 Checking for knowledge file at: {KNOWLEDGE_PATH}")
-        print(f"📂 Directory contents: {[p.name for p in BASE_DIR.iterdir()]}")
-        print(f"📄 File exists? {KNOWLEDGE_PATH.exists()}")
-        with open("paros_knowledge.txt", "r", encoding="utf-8") as f:
-            paros_knowledge = f.read()[:10000]  # limit for prompt size
-    except FileNotFoundError:
-        paros_knowledge = ""
-
-    # Construct the prompt
-    prompt = f"{question}"
-    # Detect weather-related question
-    if "weather" in question.lower():
-        weather_info = get_paros_weather()
-        if weather_info:
-            return JSONResponse(content={"answer": weather_info})
+        # Only the text that fits the prompt is extracted; the upload is never read whole
+        upload = await uploads.read_upload(file)
+        logs.debug("ask.file", filename=file.filename, size=file.size, kind=upload.kind, chars=len(upload.text))
+        file_hash = upload.digest
+        file_text = upload.text
+
+    # Weather, bus, pharmacy/ATM and "is X open" questions are answered from local data
+    if not file_text:
+        intent, answer = await route_question(question)
+        if answer:
+            metrics.ASK_ROUTED.inc(intent=intent)
+            if stream:
+                return sse_response(single_token(answer), on_done=lambda text: {"answer": text, "intent": intent})
+            return JSONResponse(content={"answer": answer, "intent": intent})
+    metrics.ASK_ROUTED.inc(intent="llm")
+
+    cache_key = answer_cache_key(question, file_hash, get_knowledge().version)
+    # The cache may be SQLite-backed, so it is only touched off the event loop
+    cached = await run_in_threadpool(answer_cache.get, cache_key)
+    if cached is not None:
+        if stream:
+            return sse_response(
+                single_token(cached),
+                on_done=lambda text: {"answer": text, "cache": cache_info(True)},
+            )
+        return JSONResponse(content={"answer": cached, "cache": cache_info(True)})
+
+    # Fixed instructions, then the question and upload; knowledge gets the remaining budget
+    builder = PromptBuilder("ask", ASK_MODEL).system(ASK_INSTRUCTIONS).user(question)
     if file_text:
-        prompt += f"\n\nThe user also uploaded a file with the following contents:\n{file_text}"
-
-    # system_prompt = "You are ParosGPT, an assistant specialized in the island of Paros, Greece."
-    # if paros_knowledge:
-    #     system_prompt += f"\nUse the following knowledge base to answer questions when possible:\n{paros_knowledge}"
-
-    # Construct prompt to prioritize knowledge
-    system_prompt = (
-        "You are a friendly, hyper-local, expert travel assistant named ParosGPT for the island of Paros, Greece. "
-        "Always answer based on the information provided below. "
-        "Use a fun but professional tone. "
-        "If the provided content doesn't include the answer, you may use general knowledge.\n\n"
-        f"{paros_knowledge}"
-    )
+        builder.user(
+            f"The user also uploaded a file with the following contents:\n{file_text}",
+            max_tokens=PROMPT_UPLOAD_TOKENS, part="upload",
+        )
+    # Only the knowledge sections relevant to the question go into the prompt
+    chunks = await retrieve(question, token_budget=min(RETRIEVAL_TOKEN_BUDGET, builder.remaining()))
+    builder.context("Paros knowledge base", format_chunks(chunks))
+    messages = builder.build()
 
     # Send to GPT
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        # model="gpt-4o",
-        messages=[
-            {
-                "role": "system", 
-                "content": system_prompt
-            },
-            {"role": "user", "content": prompt}
-        ]
-    )
+    if stream:
+        async def finish(text):
+            await run_in_threadpool(answer_cache.set, cache_key, text.strip())
+            return {"answer": text.strip(), "cache": cache_info(False)}
 
-    answer = response.choices[0].message.content.strip()
-    return JSONResponse(content={"answer": answer})
-
-class ItineraryRequest(BaseModel):
-    firstName: str
-    lastName: str
-    arrivalDate: str
-    departureDate: str
-    numPeople: int
-    travelType: str
-    pace: str
-    accessibility: str
-    interests: str
-
-class ItineraryRequest(BaseModel):
-    days: int
-    adults: int
-    children: int
-    transportation: str
-    ageRange: str
-    budget: str
-    priorities: str
+        return sse_response(stream_tokens(ASK_MODEL, messages), on_done=finish)
 
-@app.post("/generate-itinerary")
-async def generate_itinerary(request: ItineraryRequest):
-    total_people = request.adults + request.children
-
-    # Estimate arrival/departure dates
-    today = datetime.today()
-    arrival = today.strftime("%Y-%m-%d")
-    departure = (today + timedelta(days=request.days)).strftime("%Y-%m-%d")
-
-    # Construct smart persona-based prompt
-    prompt = (
-        f"Create a travel itinerary for a group of {total_people} people staying in Paros, Greece, "
-        f"from {arrival} to {departure} ({request.days} days). "
-        f"They are traveling with {request.adults} adult(s) and {request.children} child(ren). "
-        f"The average age range is {request.ageRange}. "
-        f"Their transportation method is: {request.transportation}. "
-        f"Their budget is {request.budget}. "
-        f"Their interests or special preferences are: {request.priorities}. "
-        f"Based on this, infer the most appropriate holiday type and mood. "
-        f"Then generate a fully customized, engaging, day-by-day itinerary. "
-        f"Each day must include a **morning**, **afternoon**, and **evening** suggestion, with a mix of sightseeing, activities, relaxation, and food options. "
-        f"Be mindful if the group includes children, or if the age group suggests nightlife. "
-        f"Start each day title with: ### Day X:"
-    )
+    answer = (await complete(ASK_MODEL, messages)).strip()
+    await run_in_threadpool(answer_cache.set, cache_key, answer)
+    return JSONResponse(content={"answer": answer, "cache": cache_info(False)})
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", 
-             "content": (
-                "You are a friendly, hyper-local AI travel concierge named ParosMate. "
-                "Only suggest real places and experiences in Paros, Greece. "
-                "Be concise and practical, but fun and local. "
-                "Suggest hidden gems. Always include activities for Morning / Afternoon / Evening. "
-                "Do NOT include generic tips or recommendations outside Paros."
-             )
-            },
-            {"role": "user", "content": prompt}
-        ]
-    )
-    print(response)
-    return {"itinerary": response.choices[0].message.content}
+@app.post("/generate-itinerary")
+async def generate_itinerary(request: ItineraryRequest, http_request: Request, stream: bool = QueryParam(False)):
+    messages = build_itinerary_messages(request)
+    slot = await admission.admit(http_request, ITINERARY_MODEL)
+
+    if stream:
+        # Each day is sent as a `day` event as soon as the next heading closes it
+        parser = DayParser()
+
+        def finish(text):
+            parser.close()
+            return {"itinerary": text, "day_plans": parser.days}
+
+        return sse_response(
+            slot.guard(stream_tokens(ITINERARY_MODEL, messages)),
+            on_done=finish,
+            on_token=lambda token: [("day", day) for day in parser.feed(token)],
+        )
+
+    async with slot:
+        itinerary = await complete(ITINERARY_MODEL, messages)
+    logs.debug("itinerary.generated", days=request.days, chars=len(itinerary))
+    return {"itinerary": itinerary, "day_plans": parse_itinerary(itinerary)}
+
+class DayRegenerateRequest(BaseModel):
+    instructions: str = ""
+
+@app.post("/itineraries/{itinerary_id}/days/{day}/regenerate")
+async def regenerate_itinerary_day(
+    itinerary_id: int,
+    day: int,
+    request: Request,
+    body: DayRegenerateRequest | None = None,
+    stream: bool = QueryParam(False),
+    user_id: int = Depends(get_current_user_id),
+):
+    trip = await run_in_threadpool(load_trip, itinerary_id, user_id)
+    if trip is None:
+        raise HTTPException(status_code=404, detail="Itinerary not found")
+    trip_request, start, days = trip
+    if not 1 <= day <= max(trip_request.days, len(days)):
+        raise HTTPException(status_code=404, detail="Day not found")
+
+    messages = build_day_messages(trip_request, days, day, start=start, instructions=body.instructions if body else "")
+    slot = await admission.admit(request, ITINERARY_MODEL)
+
+    if stream:
+        async def finish(text):
+            return {"day": await run_in_threadpool(save_day, itinerary_id, day, text)}
+
+        return sse_response(slot.guard(stream_tokens(ITINERARY_MODEL, messages)), on_done=finish)
+
+    async with slot:
+        text = await complete(ITINERARY_MODEL, messages)
+    return {"day": await run_in_threadpool(save_day, itinerary_id, day, text)}
+
+MAP_EXPLORER_MODEL = "gpt-4o"
+MAP_EXPLORER_INSTRUCTIONS = (
+    "You are a helpful travel assistant specialized in Paros, Greece. "
+    "Given an activity type (like beaches, eating, drinking, etc.), "
+    "suggest exactly 10 **well-known and real** places in Paros. "
+    "Each suggestion **must** be in the exact format below (each on its own line):\n\n"
+    "Name - Description\n\n"
+    "Ensure the coordinates are accurate and on Paros island. "
+    "Do not include locations in the sea or outside Paros. Only return the list."
+)
 
 @app.post("/map_explorer")
-async def map_explorer(activity: str = Form(...)):
-    system_prompt = (
-        "You are a helpful travel assistant specialized in Paros, Greece. "
-        "Given an activity type (like beaches, eating, drinking, etc.), "
-        "suggest exactly 10 **well-known and real** places in Paros. "
-        "Each suggestion **must** be in the exact format below (each on its own line):\n\n"
-        "Name - Description\n\n"
-        "Ensure the coordinates are accurate and on Paros island. "
-        "Do not include locations in the sea or outside Paros. Only return the list."
+async def map_explorer(
+    request: Request,
+    activity: str = Form(...),
+    min_lat: float = Form(None),
+    min_lng: float = Form(None),
+    max_lat: float = Form(None),
+    max_lng: float = Form(None),
+    lat: float = Form(None),
+    lng: float = Form(None),
+    radius_km: float = Form(None),
+    limit: int = Form(10),
+    stream: bool = QueryParam(False),
+):
+    # Answer from the local place catalog when it knows this activity
+    bbox = (min_lat, min_lng, max_lat, max_lng) if None not in (min_lat, min_lng, max_lat, max_lng) else None
+    near = (lat, lng) if lat is not None and lng is not None else None
+    places, last_updated = await run_in_threadpool(
+        query_places, activity, bbox=bbox, near=near, radius_km=radius_km, limit=min(max(limit, 1), 50)
     )
-
-    user_prompt = f"Suggest 10 places in Paros for the activity: {activity}"
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
+    if last_updated is not None:
+        answer = "\n".join(f"{p['name']} - {p['description']}" for p in places)
+        if stream:
+            return sse_response(single_token(answer), on_done=lambda text: {"answer": text, "places": places})
+        return {"answer": answer, "places": places}
+
+    # Not in the catalog yet: vetted activities are fetched in the background; the LLM answers this time
+    schedule_refresh(activity)
+
+    messages = (
+        PromptBuilder("map_explorer", MAP_EXPLORER_MODEL)
+        .system(MAP_EXPLORER_INSTRUCTIONS)
+        .user(f"Suggest 10 places in Paros for the activity: {activity}")
+        .build()
     )
-    print(response.choices[0].message.content)
-    return {"answer": response.choices[0].message.content}
+    slot = await admission.admit(request, MAP_EXPLORER_MODEL)
+
+    if stream:
+        return sse_response(
+            slot.guard(stream_tokens(MAP_EXPLORER_MODEL, messages)),
+            on_done=lambda text: {"answer": text},
+        )
+
+    async with slot:
+        answer = await complete(MAP_EXPLORER_MODEL, messages)
+    logs.debug("map_explorer.answered", activity=activity, chars=len(answer))
+    return {"answer": answer}
+
+REVIEW_MODEL = "gpt-4o"
+REVIEW_INSTRUCTIONS = (
+    "You are an expert review summarizer for places in Paros, Greece.\n\n"
+    "Return ONLY a JSON object in the following format:\n"
+    "{\n"
+    '  "pros": ["(explanative phrase)", "(explanative phrase)", "..."],\n'
+    '  "cons": ["(explanative phrase)", "(explanative phrase)", "..."],\n'
+    '  "rating": float between 0 and 5 coming from TripAdvisor,\n'
+    '  "summary": "a short paragraph (5–6 lines) summarizing the above"\n'
+    "}\n\n"
+    "NO markdown, no comments, no explanations — just the raw JSON object."
+)
 
 class ReviewRequest(BaseModel):
     place: str
     type: str
 
 @app.post("/reviews")
-async def get_review_summary(data: ReviewRequest):
-    prompt = (
-        f"You are an expert review summarizer. Summarize user reviews for '{data.place}', a '{data.type}' in Paros, from Google and TripAdvisor.\n\n"
-        # "Search for the place and find any information you can from Google and TripAdvisor to summarize them.\n"
-        "Return ONLY a JSON object in the following format:\n"
-        "{\n"
-        '  "pros": ["(explanative phrase)", "(explanative phrase)", "..."],\n'
-        '  "cons": ["(explanative phrase)", "(explanative phrase)", "..."],\n'
-        '  "rating": float between 0 and 5 coming from TripAdvisor,\n'
-        '  "summary": "a short paragraph (5–6 lines) summarizing the above"\n'
-        "}\n\n"
-        "NO markdown, no comments, no explanations — just the raw JSON object."
+async def get_review_summary(data: ReviewRequest, request: Request, stream: bool = QueryParam(False)):
+    messages = (
+        PromptBuilder("reviews", REVIEW_MODEL)
+        .system(REVIEW_INSTRUCTIONS)
+        .user(f"Summarize user reviews for '{data.place}', a '{data.type}' in Paros, from Google and TripAdvisor.")
+        .build()
     )
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7,
-    )
+    # Stored summaries are free; callers needing a generation are rate-checked before
+    # joining it, and the single LLM call holds the model slot
+    async def generate():
+        async with await admission.acquire(REVIEW_MODEL):
+            content = (await complete(REVIEW_MODEL, messages, temperature=0.7)).strip()
+        logs.debug("reviews.generated", place=data.place, chars=len(content))
+        return content
 
-    content = completion.choices[0].message.content.strip()
-    print("LLM Output:", content)
+    summary = await get_or_create_summary(
+        data.place, data.type, generate, admit=lambda: admission.check_rate(request, REVIEW_MODEL)
+    )
+    if stream:
+        # Streamed requests share the stored summary and in-flight generation too; the
+        # summary is replayed as one JSON token and arrives parsed in the `done` event
+        return sse_response(single_token(json.dumps(summary, ensure_ascii=False)), on_done=lambda text: summary)
+    return summary
 
-    # Try to parse the JSON from GPT
-    import json, re
-    try:
-        parsed = json.loads(content)
-    except json.JSONDecodeError:
-        # Fallback: remove markdown code block if present
-        cleaned = re.sub(r"^```json|```$", "", content, flags=re.MULTILINE).strip()
-        parsed = json.loads(cleaned)
-
-    return {
-        "pros": parsed.get("pros", []),
-        "cons": parsed.get("cons", []),
-        "summary": parsed.get("summary", ""),
-        "rating": round(float(parsed.get("rating", 4.3)), 1)
-    }
-
-
-LAT, LON = 37.084, 25.150
-
-@app.get("/weather/current")
-def get_current_weather():
-    API_KEY = os.getenv("OPENWEATHER_API_KEY")
-    url = f"https://api.openweathermap.org/data/2.5/weather?lat={LAT}&lon={LON}&appid={API_KEY}&units=metric"
-    res = requests.get(url)
-    return JSONResponse(content=res.json())
-
-@app.get("/weather/forecast")
-def get_forecast_weather():
-    API_KEY = os.getenv("OPENWEATHER_API_KEY")
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={LAT}&lon={LON}&appid={API_KEY}&units=metric"
-    res = requests.get(url)
-    return JSONResponse(content=res.json())
 
 @app.get("/update_bus_data")
-def update_bus_data():
+async def update_bus_data(force: bool = QueryParam(False)):
+    # The ingester also runs on a schedule; this triggers a check now (unchanged pages are skipped)
     try:
-        update_knowledge_file_basic_summary()
-        return {"status": "success", "message": "paros_knowledge.txt updated with latest bus data."}
+        result = await scrape_ktel.refresh(force=force)
+        return {"status": "success", "message": "Bus timetables checked.", **result}
     except Exception as e:
         return {"status": "error", "message": str(e)}
\ No newline at end of file
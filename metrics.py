@@ -0,0 +1,244 @@
+# metrics.py
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import cache
+
+try:
+    from opentelemetry import trace
+except ImportError:  # spans are skipped when opentelemetry isn't installed
+    trace = None
+
+router = APIRouter()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_registry = []
+_tracer = trace.get_tracer("parosmate") if trace else None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', _number(bound))])} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class CacheCollector:
+    """Hit/miss counters and hit ratio for every named cache in cache.caches."""
+
+    def __init__(self):
+        _registry.append(self)
+
+    def collect(self):
+        rows = sorted((name, c.hits, c.misses) for name, c in cache.caches.items())
+        lines = ["# HELP cache_hits_total Cache lookups that found a fresh entry.", "# TYPE cache_hits_total counter"]
+        lines += [f'cache_hits_total{{cache="{name}"}} {hits}' for name, hits, _ in rows]
+        lines += ["# HELP cache_misses_total Cache lookups that missed or found an expired entry.",
+                  "# TYPE cache_misses_total counter"]
+        lines += [f'cache_misses_total{{cache="{name}"}} {misses}' for name, _, misses in rows]
+        lines += ["# HELP cache_hit_ratio Hits over lookups since start.", "# TYPE cache_hit_ratio gauge"]
+        lines += [f'cache_hit_ratio{{cache="{name}"}} {_number(hits / (hits + misses) if hits + misses else 0.0)}'
+                  for name, hits, misses in rows]
+        return lines
+
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to fully send a response, by route template.",
+    labels=("method", "route", "status"),
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Outbound call latency (for streams, until the last chunk).",
+    labels=("upstream", "target", "outcome"),
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total", "Failed outbound calls by error kind.",
+    labels=("upstream", "target", "error"),
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Delay before the first streamed token.", labels=("model",),
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens reported in chat completion usage.", labels=("model", "type"),
+)
+ASK_ROUTED = Counter(
+    "ask_routed_total", "/ask questions by handler (\"llm\" when no local intent answered).", labels=("intent",),
+)
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Prompt size by endpoint and part (system, context, user, upload, total).",
+    labels=("endpoint", "part"), buckets=TOKEN_BUCKETS,
+)
+PROMPT_TRUNCATIONS = Counter(
+    "llm_prompt_truncations_total", "Prompt parts cut to fit the token budget.", labels=("endpoint", "part"),
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "LLM requests turned away by admission control.", labels=("reason", "model"),
+)
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds", "Time spent queued for a model slot (admitted requests that had to wait).",
+    labels=("model",),
+)
+PASSWORD_HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds", "Time a bcrypt job waited for a worker process.", labels=("operation",),
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_seconds", "Time spent hashing or verifying in the worker process.", labels=("operation",),
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total", "bcrypt jobs turned away with a 503 because the queue was full.",
+    labels=("operation",),
+)
+CacheCollector()
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def record_usage(model, usage):
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, type="prompt")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, type="completion")
+
+
+@contextmanager
+def upstream_call(upstream, target):
+    """
+    Time one outbound call and wrap it in an OpenTelemetry span when available.
+
+    Yields a dict; set `call["error"]` to count a call that returned normally
+    (e.g. an HTTP 5xx) as failed.
+    """
+    call = {"error": None}
+    span = _tracer.start_span(f"{upstream} {target}", attributes={"upstream": upstream, "target": target}) \
+        if _tracer else None
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield call
+        if call["error"]:
+            outcome = "error"
+            UPSTREAM_ERRORS.inc(upstream=upstream, target=target, error=call["error"])
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = "error"
+        UPSTREAM_ERRORS.inc(upstream=upstream, target=target, error=type(e).__name__)
+        if span is not None:
+            span.record_exception(e)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream=upstream, target=target, outcome=outcome)
+        if span is not None:
+            if outcome == "error":
+                span.set_status(trace.Status(trace.StatusCode.ERROR, call["error"]))
+            span.end()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, including streamed bodies."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status)
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,94 @@
+# password_hashing.py
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+import metrics
+
+# bcrypt cost factor; existing hashes with another cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash jobs allowed to run or wait at once before new ones get a 503
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+RETRY_AFTER_SECONDS = 2
+
+_executor = None
+_pending = 0
+_context = None
+
+
+def _get_context(rounds):
+    # Built lazily inside each worker process
+    global _context
+    if _context is None:
+        _context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return _context
+
+
+def _hash_job(password, rounds):
+    started = time.perf_counter()
+    hashed = _get_context(rounds).hash(password)
+    return hashed, started, time.perf_counter() - started
+
+
+def _verify_job(password, hashed, rounds):
+    started = time.perf_counter()
+    try:
+        valid, new_hash = _get_context(rounds).verify_and_update(password, hashed)
+    except (ValueError, TypeError):
+        valid, new_hash = False, None
+    return (valid, new_hash), started, time.perf_counter() - started
+
+
+def start():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _record(operation, submitted, started, duration):
+    # perf_counter is system-wide on Linux, so parent and child timestamps compare
+    metrics.PASSWORD_HASH_QUEUE_WAIT.observe(max(0.0, started - submitted), operation=operation)
+    metrics.PASSWORD_HASH_DURATION.observe(duration, operation=operation)
+
+
+async def _run(operation, func, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_QUEUE:
+        metrics.PASSWORD_HASH_REJECTED.inc(operation=operation)
+        raise HTTPException(
+            status_code=503,
+            detail="Authentication is busy, please retry shortly",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    start()
+    _pending += 1
+    submitted = time.perf_counter()
+    try:
+        result, started, duration = await asyncio.get_running_loop().run_in_executor(
+            _executor, func, *args, BCRYPT_ROUNDS
+        )
+    finally:
+        _pending -= 1
+    _record(operation, submitted, started, duration)
+    return result
+
+
+async def hash_password(password):
+    return await _run("hash", _hash_job, password)
+
+
+async def verify_password(password, hashed):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be upgraded."""
+    return await _run("verify", _verify_job, password, hashed)
@@ -0,0 +1,273 @@
+# place_catalog.py
+import os
+import re
+import json
+import math
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+
+import logs
+from models import SessionLocal, Place
+from quick_services import nearby_places, GOOGLE_API_KEY
+from llm import complete
+import admission
+
+# How often each activity's places are re-fetched from Google Places
+PLACE_CATALOG_REFRESH = timedelta(hours=float(os.getenv("PLACE_CATALOG_REFRESH_HOURS", "24")))
+GEOHASH_PRECISION = 7
+CELL_PRECISION = 5  # ~4.9km x 4.9km cells at Paros' latitude
+ENRICH_MODEL = "gpt-4o"
+
+# Map explorer activity -> (Google place type, keyword)
+ACTIVITY_SOURCES = {
+    "beaches": (None, "beach"),
+    "eating": ("restaurant", None),
+    "drinking": ("bar", None),
+    "coffee": ("cafe", None),
+    "nightlife": ("night_club", None),
+    "sightseeing": ("tourist_attraction", None),
+    "museums": ("museum", None),
+    "churches": ("church", None),
+    "shopping": ("store", None),
+    "hiking": (None, "hiking trail"),
+    "water sports": (None, "water sports"),
+}
+# Further vetted activities (comma separated), looked up in Places by keyword. Only
+# listed activities are ever fetched, so free-text input cannot add Places or LLM spend.
+PLACE_CATALOG_EXTRA_ACTIVITIES = {
+    " ".join(a.lower().split()): (None, " ".join(a.lower().split()))
+    for a in os.getenv("PLACE_CATALOG_EXTRA_ACTIVITIES", "").split(",") if a.strip()
+}
+CATALOG_ACTIVITIES = {**PLACE_CATALOG_EXTRA_ACTIVITIES, **ACTIVITY_SOURCES}
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_refresher = None
+_refreshing = set()
+_background = set()
+
+
+def normalize_activity(activity):
+    return " ".join(re.sub(r"[^\w\s]", " ", activity.lower()).split())
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits = bits * 2
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng, limit=400):
+    """Geohash cells (CELL_PRECISION) overlapping a bounding box, or None if there are too many."""
+    lat_step = 180.0 / 2 ** (CELL_PRECISION * 5 // 2) / 2
+    lng_step = 360.0 / 2 ** (CELL_PRECISION * 5 - CELL_PRECISION * 5 // 2) / 2
+    rows = math.ceil((max_lat - min_lat) / lat_step) + 1
+    cols = math.ceil((max_lng - min_lng) / lng_step) + 1
+    if rows * cols > limit * 4:
+        return None
+    cells = set()
+    for i in range(rows + 1):
+        lat = min(min_lat + i * lat_step, max_lat)
+        for j in range(cols + 1):
+            lng = min(min_lng + j * lng_step, max_lng)
+            cells.add(geohash_encode(lat, lng, CELL_PRECISION))
+    return cells if len(cells) <= limit else None
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+def bbox_around(lat, lng, radius_km):
+    dlat = radius_km / 111.0
+    dlng = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+def query_places(activity, bbox=None, near=None, radius_km=None, limit=10):
+    """
+    Query the catalog for an activity.
+
+    `bbox` is (min_lat, min_lng, max_lat, max_lng); `near` is (lat, lng) and,
+    with `radius_km`, restricts and orders results by distance.
+    Returns (places, last_updated) where last_updated is None for an unknown activity.
+    """
+    category = normalize_activity(activity)
+    if near and radius_km:
+        bbox = bbox_around(near[0], near[1], radius_km)
+
+    db = SessionLocal()
+    try:
+        query = db.query(Place).filter(Place.category == category)
+        if bbox:
+            min_lat, min_lng, max_lat, max_lng = bbox
+            cells = covering_cells(min_lat, min_lng, max_lat, max_lng)
+            if cells:
+                query = query.filter(Place.cell.in_(cells))
+            query = query.filter(
+                Place.latitude.between(min_lat, max_lat),
+                Place.longitude.between(min_lng, max_lng),
+            )
+        rows = query.all()
+        last_updated = db.query(Place.updated_at).filter(Place.category == category) \
+            .order_by(Place.updated_at.desc()).limit(1).scalar()
+    finally:
+        db.close()
+
+    places = []
+    for row in rows:
+        place = {
+            "name": row.name,
+            "description": row.description or "",
+            "category": row.category,
+            "lat": row.latitude,
+            "lng": row.longitude,
+            "rating": row.rating,
+        }
+        if near:
+            place["distance_km"] = round(haversine_km(near[0], near[1], row.latitude, row.longitude), 2)
+            if radius_km and place["distance_km"] > radius_km:
+                continue
+        places.append(place)
+
+    if near:
+        places.sort(key=lambda p: p["distance_km"])
+    else:
+        places.sort(key=lambda p: (-(p["rating"] or 0), p["name"]))
+    return places[:limit], last_updated
+
+
+async def _describe(names, activity):
+    """Ask the LLM for one-line descriptions of the given places in a single call."""
+    prompt = (
+        f"For each of these places in Paros, Greece (activity: {activity}), write a one-sentence, "
+        "factual description for a visitor. Return ONLY a JSON object mapping each exact name to its description.\n\n"
+        + "\n".join(f"- {name}" for name in names)
+    )
+    # Shares the model's concurrency limit with the endpoints; background work waits instead of failing
+    async with await admission.acquire(ENRICH_MODEL, timeout=None):
+        content = await complete(ENRICH_MODEL, [{"role": "user", "content": prompt}], temperature=0.2)
+    cleaned = re.sub(r"^```json|```$", "", content.strip(), flags=re.MULTILINE).strip()
+    try:
+        descriptions = json.loads(cleaned)
+    except json.JSONDecodeError:
+        return {}
+    return descriptions if isinstance(descriptions, dict) else {}
+
+
+def _store_places(category, results, descriptions):
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        existing = {p.google_place_id: p for p in db.query(Place).filter(Place.category == category)}
+        for result in results:
+            location = result.get("geometry", {}).get("location") or {}
+            if "lat" not in location or "lng" not in location:
+                continue
+            place = existing.get(result.get("place_id"))
+            if place is None:
+                place = Place(google_place_id=result.get("place_id"), category=category)
+                db.add(place)
+            place.name = result.get("name")
+            place.latitude = location["lat"]
+            place.longitude = location["lng"]
+            place.geohash = geohash_encode(location["lat"], location["lng"])
+            place.cell = place.geohash[:CELL_PRECISION]
+            place.rating = result.get("rating")
+            place.description = descriptions.get(place.name) or place.description
+            place.updated_at = now
+        db.commit()
+    finally:
+        db.close()
+
+
+async def refresh_activity(activity):
+    """Rebuild the catalog entries for one activity from Google Places plus LLM descriptions."""
+    category = normalize_activity(activity)
+    if category not in CATALOG_ACTIVITIES or category in _refreshing or not GOOGLE_API_KEY:
+        return
+    _refreshing.add(category)
+    try:
+        type, keyword = CATALOG_ACTIVITIES[category]
+        results = await nearby_places(type, keyword)
+        if not results:
+            return
+        try:
+            descriptions = await _describe([r.get("name") for r in results if r.get("name")], category)
+        except Exception as e:
+            logs.warning("place_catalog.enrich_failed", category=category, error=str(e))
+            descriptions = {}
+        await run_in_threadpool(_store_places, category, results, descriptions)
+        logs.info("place_catalog.refreshed", category=category, places=len(results))
+    except Exception as e:
+        logs.warning("place_catalog.refresh_failed", category=category, error=str(e))
+    finally:
+        _refreshing.discard(category)
+
+
+def is_catalog_activity(activity):
+    return normalize_activity(activity) in CATALOG_ACTIVITIES
+
+
+def schedule_refresh(activity):
+    if not is_catalog_activity(activity):
+        return
+    task = asyncio.create_task(refresh_activity(activity))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _stale_categories():
+    cutoff = datetime.utcnow() - PLACE_CATALOG_REFRESH
+    db = SessionLocal()
+    try:
+        fresh = {c for (c,) in db.query(Place.category).filter(Place.updated_at >= cutoff).distinct()}
+    finally:
+        db.close()
+    return set(CATALOG_ACTIVITIES) - fresh
+
+
+async def _refresh_loop():
+    while True:
+        for category in sorted(await run_in_threadpool(_stale_categories)):
+            await refresh_activity(category)
+        await asyncio.sleep(PLACE_CATALOG_REFRESH.total_seconds() / 4)
+
+
+def start_refresher():
+    global _refresher
+    if _refresher is None:
+        _refresher = asyncio.create_task(_refresh_loop())
+
+
+async def stop_refresher():
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        try:
+            await _refresher
+        except asyncio.CancelledError:
+            pass
+        _refresher = None
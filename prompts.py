@@ -0,0 +1,177 @@
+# prompts.py
+"""
+Token-budgeted prompt assembly shared by the LLM endpoints.
+
+Messages are laid out static-first: the fixed instructions, then reference
+material (knowledge), then the per-request input. The savings come from the
+token budgets: the instructions are well under the 1024 tokens a provider-side
+prefix cache needs, and /ask's retrieved knowledge changes per question.
+"""
+import os
+import re
+from functools import lru_cache
+
+import metrics
+
+try:
+    import tiktoken
+except ImportError:  # falls back to a ~4 characters per token estimate
+    tiktoken = None
+
+# Context window per model; the prompt budget leaves RESPONSE_RESERVE_TOKENS of it for the answer
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+RESPONSE_RESERVE_TOKENS = 2048
+# Hard cap on prompt size regardless of the window, to bound cost
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "6000"))
+# Per-part caps for untrusted input
+PROMPT_USER_TOKENS = int(os.getenv("PROMPT_USER_TOKENS", "500"))
+PROMPT_UPLOAD_TOKENS = int(os.getenv("PROMPT_UPLOAD_TOKENS", "250"))
+
+# Chat format overhead: a few tokens per message plus the reply primer
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+_BREAKS = (re.compile(r"\n\s*\n"), re.compile(r"\n"), re.compile(r"\s"))
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model="gpt-4o"):
+    if not text:
+        return 0
+    if tiktoken is None:
+        return max(1, len(text) // 4)
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def prompt_budget(model):
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return min(context - RESPONSE_RESERVE_TOKENS, PROMPT_MAX_TOKENS)
+
+
+def _prefix(text, model, max_tokens):
+    """The longest prefix of `text` that is at most `max_tokens` tokens (may end mid-word)."""
+    if tiktoken is None:
+        return text[:max_tokens * 4]
+    encoding = _encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    # Decoding a cut token sequence can leave a partial character at the end
+    return encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")
+
+
+def fit(text, max_tokens, model="gpt-4o"):
+    """
+    Trim `text` to at most `max_tokens` tokens, cutting at the last paragraph,
+    line or word break so the prompt never ends inside a word.
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    head = _prefix(text, model, max_tokens)
+    for pattern in _BREAKS:
+        cuts = [m.start() for m in pattern.finditer(head)]
+        # Only accept a break that keeps most of the allowance
+        if cuts and cuts[-1] >= len(head) // 2:
+            return head[:cuts[-1]].rstrip()
+    return head.rstrip()
+
+
+class PromptBuilder:
+    """
+    Collects prompt parts and lays them out as chat messages within the model's budget.
+
+        builder = PromptBuilder("ask", "gpt-3.5-turbo")
+        builder.system(INSTRUCTIONS)
+        builder.user(question)
+        builder.context("Knowledge base", knowledge)   # gets what the other parts leave
+        messages = builder.build()
+
+    System instructions are kept whole; user input is capped first, and context
+    parts share the remaining budget in the order they were added.
+    """
+
+    def __init__(self, endpoint, model, budget=None):
+        self.endpoint = endpoint
+        self.model = model
+        self.budget = budget if budget is not None else prompt_budget(model)
+        self._system = []
+        self._context = []  # (label, text)
+        self._user = []  # (part, text, max_tokens)
+
+    def system(self, text):
+        self._system.append(text)
+        return self
+
+    def context(self, label, text):
+        if text:
+            self._context.append((label, text))
+        return self
+
+    def user(self, text, max_tokens=PROMPT_USER_TOKENS, part="user"):
+        if text:
+            self._user.append((part, text, max_tokens))
+        return self
+
+    def remaining(self):
+        """Tokens left for context after the instructions and (capped) user input."""
+        used = REPLY_OVERHEAD_TOKENS + MESSAGE_OVERHEAD_TOKENS * (len(self._system) + 1 + len(self._context))
+        used += sum(count_tokens(text, self.model) for text in self._system)
+        used += sum(min(count_tokens(text, self.model), limit) for _, text, limit in self._user)
+        return max(0, self.budget - used)
+
+    def build(self):
+        sizes = {}
+        truncated = set()
+        messages = []
+
+        for text in self._system:
+            messages.append({"role": "system", "content": text})
+            sizes["system"] = sizes.get("system", 0) + count_tokens(text, self.model)
+
+        user_parts = []
+        for part, text, limit in self._user:
+            kept = fit(text, limit, self.model)
+            if kept != text:
+                truncated.add(part)
+            user_parts.append(kept)
+            sizes[part] = sizes.get(part, 0) + count_tokens(kept, self.model)
+
+        available = self.remaining()
+        for label, text in self._context:
+            header = f"{label}:\n"
+            allowance = max(0, available - count_tokens(header, self.model))
+            kept = fit(text, allowance, self.model)
+            if kept != text:
+                truncated.add("context")
+            if not kept:
+                continue
+            content = header + kept
+            tokens = count_tokens(content, self.model)
+            available -= tokens
+            # Reference material goes right after the instructions, ahead of the per-request input
+            messages.append({"role": "system", "content": content})
+            sizes["context"] = sizes.get("context", 0) + tokens
+
+        messages.append({"role": "user", "content": "\n\n".join(user_parts)})
+
+        total = REPLY_OVERHEAD_TOKENS + sum(
+            MESSAGE_OVERHEAD_TOKENS + count_tokens(m["content"], self.model) for m in messages
+        )
+        for part, tokens in sizes.items():
+            metrics.PROMPT_TOKENS.observe(tokens, endpoint=self.endpoint, part=part)
+        metrics.PROMPT_TOKENS.observe(total, endpoint=self.endpoint, part="total")
+        for part in truncated:
+            metrics.PROMPT_TRUNCATIONS.inc(endpoint=self.endpoint, part=part)
+        return messages
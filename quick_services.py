@@ -1,10 +1,13 @@
 # quick_services.py
 
 import os
-import requests
-from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import http_client
+import logs
+from fastapi import APIRouter, Query, HTTPException, Request
+from http_cache import cached_json
 from dotenv import load_dotenv
+from cache import TTLCache, SingleFlight
 
 load_dotenv()
 
@@ -14,57 +17,127 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 PAROS_LAT = 37.0853
 PAROS_LNG = 25.1500
 
-@router.get("/quick_services")
-def get_quick_services(type: str = Query(...)):
-    if not GOOGLE_API_KEY:
-        print("GOOGLE API ERROR:", data)
-        raise HTTPException(status_code=500, detail="Missing Google API Key")
+PLACES_URL = os.getenv("PLACES_URL", "https://maps.googleapis.com/maps/api/place")
+NEARBY_URL = f"{PLACES_URL}/nearbysearch/json"
+DETAILS_URL = f"{PLACES_URL}/details/json"
+FIND_PLACE_URL = f"{PLACES_URL}/findplacefromtext/json"
 
-    url = (
-        "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-        f"?location={PAROS_LAT},{PAROS_LNG}"
-        f"&radius=15000"
-        f"&type={type}"
-        f"&key={GOOGLE_API_KEY}"
-    )
+# Max Place Details requests in flight at once
+DETAILS_CONCURRENCY = int(os.getenv("PLACES_DETAILS_CONCURRENCY", "8"))
 
-    response = requests.get(url)
-    data = response.json()
+# Phone numbers almost never change; nearby results (open_now) do
+phone_cache = TTLCache(maxsize=5000, ttl=7 * 24 * 3600, name="phone_cache")
+nearby_cache = TTLCache(maxsize=64, ttl=10 * 60, name="nearby_cache")
+find_place_cache = TTLCache(maxsize=1000, ttl=10 * 60, name="find_place_cache")
 
-    if data.get("status") != "OK":
-        print("GOOGLE API ERROR:", data)
-        raise HTTPException(status_code=500, detail=data.get("error_message", "Google API Error"))
+_details_semaphore = asyncio.Semaphore(DETAILS_CONCURRENCY)
+_flights = SingleFlight()
+_MISSING = object()
 
-    places = []
 
-    for place in data.get("results", []):
-        place_id = place.get("place_id")
+async def fetch_phone(place_id):
+    cached = phone_cache.get(place_id)
+    if cached is not None:
+        return cached or None  # "" marks a place without a phone number
 
-        # Fetch phone number from details endpoint
-        phone = None
+    phone = _MISSING
+    async with _details_semaphore:
         try:
-            detail_url = (
-                f"https://maps.googleapis.com/maps/api/place/details/json"
-                f"?place_id={place_id}"
-                f"&fields=formatted_phone_number"
-                f"&key={GOOGLE_API_KEY}"
-            )
-            detail_res = requests.get(detail_url)
-            if detail_res.ok:
-                detail_data = detail_res.json()
-                phone = detail_data.get("result", {}).get("formatted_phone_number")
+            detail_res = await http_client.get("places", DETAILS_URL, params={
+                "place_id": place_id,
+                "fields": "formatted_phone_number",
+                "key": GOOGLE_API_KEY,
+            })
+            if detail_res.is_success:
+                phone = detail_res.json().get("result", {}).get("formatted_phone_number")
         except Exception as e:
-            print(f"Failed to fetch phone for {place_id}: {e}")
+            logs.warning("places.phone_failed", place_id=place_id, error=str(e))
+
+    if phone is _MISSING:
+        return None  # don't cache failures
+    phone_cache.set(place_id, phone or "")
+    return phone
+
+
+async def _fetch_nearby(type, keyword=None):
+    params = {
+        "location": f"{PAROS_LAT},{PAROS_LNG}",
+        "radius": 15000,
+        "key": GOOGLE_API_KEY,
+    }
+    if type:
+        params["type"] = type
+    if keyword:
+        params["keyword"] = keyword
+    response = await http_client.get("places", NEARBY_URL, params=params)
+    data = response.json()
+
+    if data.get("status") not in ("OK", "ZERO_RESULTS"):
+        logs.error("places.api_error", status=data.get("status"), message=data.get("error_message"))
+        raise HTTPException(status_code=500, detail=data.get("error_message", "Google API Error"))
+
+    results = data.get("results", [])
+    nearby_cache.set((type, keyword), results)
+    return results
 
+
+async def nearby_places(type, keyword=None):
+    """Raw nearbysearch results for `type` (and optional keyword) around Paros, cached for a few minutes."""
+    key = (type, keyword)
+    results = nearby_cache.get(key)
+    if results is None:
+        results = await _flights.do(key, _fetch_nearby, type, keyword)
+    return results
+
+
+async def _find_place(name):
+    response = await http_client.get("places", FIND_PLACE_URL, params={
+        "input": f"{name}, Paros",
+        "inputtype": "textquery",
+        "fields": "place_id,name,formatted_address,opening_hours",
+        "locationbias": f"circle:15000@{PAROS_LAT},{PAROS_LNG}",
+        "key": GOOGLE_API_KEY,
+    })
+    data = response.json()
+    if data.get("status") not in ("OK", "ZERO_RESULTS"):
+        logs.error("places.api_error", status=data.get("status"), message=data.get("error_message"))
+        return None
+    candidates = data.get("candidates") or []
+    place = candidates[0] if candidates else {}
+    find_place_cache.set(name.lower(), place)
+    return place
+
+
+async def find_place(name):
+    """Best Places match for a name on Paros ({} when nothing matched), cached for a few minutes."""
+    place = find_place_cache.get(name.lower())
+    if place is None:
+        place = await _flights.do(("find", name.lower()), _find_place, name)
+    return place
+
+
+async def get_places_with_phones(type):
+    results = await nearby_places(type)
+    phones = await asyncio.gather(*(fetch_phone(place.get("place_id")) for place in results))
+
+    places = []
+    for place, phone in zip(results, phones):
         places.append({
-            "id": place_id,
+            "id": place.get("place_id"),
             "name": place.get("name"),
             "address": place.get("vicinity"),
             "open_now": place.get("opening_hours", {}).get("open_now"),
             "location": place.get("geometry", {}).get("location"),
             "phone": phone
         })
+    return places
 
 
+@router.get("/quick_services")
+async def get_quick_services(request: Request, type: str = Query(...)):
+    if not GOOGLE_API_KEY:
+        logs.error("places.api_error", message="GOOGLE_API_KEY is not set")
+        raise HTTPException(status_code=500, detail="Missing Google API Key")
 
-    return JSONResponse(content=places)
+    places = await get_places_with_phones(type)
+    return cached_json(request, places, max_age=nearby_cache.ttl, stale_while_revalidate=60)
@@ -0,0 +1,216 @@
+# retrieval.py
+import os
+import re
+import math
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+import logs
+from knowledge import get_knowledge
+from prompts import count_tokens
+
+try:
+    import numpy as np
+except ImportError:  # embeddings are optional
+    np = None
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1500"))
+# Set RETRIEVAL_EMBEDDINGS=1 (and install numpy) to blend embedding similarity into BM25
+RETRIEVAL_EMBEDDINGS = os.getenv("RETRIEVAL_EMBEDDINGS", "0") == "1" and np is not None
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "some", "the", "there", "to", "we",
+    "what", "when", "where", "which", "who", "with", "you", "your", "paros",
+}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in STOPWORDS and len(w) > 1]
+
+
+@dataclass(frozen=True)
+class Chunk:
+    position: int
+    section: str
+    text: str
+    digest: str
+
+
+def split_knowledge(text):
+    """
+    Split the knowledge file into retrievable chunks.
+
+    A new chunk starts at every `## Section` heading and at every `- Name: ...`
+    bullet. Continuation lines stay with their bullet, and each chunk remembers
+    the heading it lives under so it still makes sense on its own.
+    """
+    chunks = []
+    section = ""
+    current = []
+
+    def flush():
+        body = "\n".join(current).strip()
+        if body:
+            digest = hashlib.sha1(f"{section}\n{body}".encode("utf-8")).hexdigest()
+            chunks.append(Chunk(position=len(chunks), section=section, text=body, digest=digest))
+        current.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("## "):
+            flush()
+            section = stripped[3:].strip().rstrip(":")
+        elif stripped.startswith("- "):
+            flush()
+            current.append(stripped)
+        else:
+            current.append(line.rstrip())
+    flush()
+    return chunks
+
+
+class KnowledgeIndex:
+    def __init__(self, version, chunks, term_freqs):
+        self.version = version
+        self.chunks = chunks
+        self.term_freqs = term_freqs
+        self.token_counts = [count_tokens(c.text) for c in chunks]
+        self.lengths = [sum(tf.values()) for tf in term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        df = Counter()
+        for tf in term_freqs:
+            df.update(tf.keys())
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+        self.embeddings = None  # numpy matrix, filled by ensure_embeddings()
+
+    def bm25_scores(self, query):
+        terms = set(tokenize(query))
+        scores = [0.0] * len(self.chunks)
+        if not terms or not self.avg_length:
+            return scores
+        for i, tf in enumerate(self.term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / self.avg_length)
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            scores[i] = score
+        return scores
+
+    def select(self, scores, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+        ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: scores[i], reverse=True)
+        if not ranked:
+            # Nothing matched: fall back to the start of the file (general overview)
+            ranked = list(range(len(self.chunks)))
+
+        picked = []
+        used = 0
+        for i in ranked:
+            if len(picked) >= top_k:
+                break
+            cost = self.token_counts[i]
+            if used + cost > token_budget:
+                continue
+            picked.append(self.chunks[i])
+            used += cost
+        # Keep document order so the prompt reads naturally
+        return sorted(picked, key=lambda c: c.position)
+
+
+_index = None
+_term_cache = {}  # chunk digest -> Counter, reused across rebuilds
+_embedding_cache = {}  # chunk digest -> vector
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the index for the current knowledge version, rebuilding changed chunks only."""
+    global _index
+    kb = get_knowledge()
+    if _index is not None and _index.version == kb.version:
+        return _index
+
+    with _lock:
+        if _index is not None and _index.version == kb.version:
+            return _index
+        chunks = split_knowledge(kb.text)
+        live = {c.digest for c in chunks}
+        term_freqs = []
+        for chunk in chunks:
+            tf = _term_cache.get(chunk.digest)
+            if tf is None:
+                tf = Counter(tokenize(f"{chunk.section} {chunk.text}"))
+                _term_cache[chunk.digest] = tf
+            term_freqs.append(tf)
+        for digest in list(_term_cache):
+            if digest not in live:
+                del _term_cache[digest]
+        for digest in list(_embedding_cache):
+            if digest not in live:
+                del _embedding_cache[digest]
+        _index = KnowledgeIndex(kb.version, chunks, term_freqs)
+        logs.info("retrieval.index_built", chunks=len(chunks), version=kb.version)
+        return _index
+
+
+async def _embed(texts):
+    from llm import client
+    response = await client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+async def ensure_embeddings(index):
+    missing = [c for c in index.chunks if c.digest not in _embedding_cache]
+    if missing:
+        vectors = await _embed([f"{c.section}\n{c.text}" for c in missing])
+        for chunk, vector in zip(missing, vectors):
+            _embedding_cache[chunk.digest] = vector
+    if index.embeddings is None and index.chunks:
+        index.embeddings = np.stack([_embedding_cache[c.digest] for c in index.chunks])
+    return index.embeddings
+
+
+async def retrieve(question, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """Return the knowledge chunks most relevant to `question` that fit in the token budget."""
+    index = get_index()
+    if not index.chunks:
+        return []
+
+    scores = index.bm25_scores(question)
+    if RETRIEVAL_EMBEDDINGS:
+        try:
+            matrix = await ensure_embeddings(index)
+            query_vector = (await _embed([question]))[0]
+            similarity = matrix @ query_vector
+            top = max(scores) or 1.0
+            # Blend normalised BM25 with cosine similarity
+            scores = list(0.5 * (np.array(scores) / top) + 0.5 * np.clip(similarity, 0, None))
+        except Exception as e:
+            logs.warning("retrieval.embeddings_failed", fallback="bm25", error=str(e))
+
+    return index.select(scores, top_k=top_k, token_budget=token_budget)
+
+
+def format_chunks(chunks):
+    parts = []
+    section = None
+    for chunk in chunks:
+        if chunk.section and chunk.section != section:
+            parts.append(f"## {chunk.section}:")
+            section = chunk.section
+        parts.append(chunk.text)
+    return "\n\n".join(parts)
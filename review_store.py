@@ -0,0 +1,135 @@
+# review_store.py
+import os
+import re
+import json
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+
+import logs
+from models import SessionLocal, ReviewSummary
+from cache import SingleFlight
+
+# Summaries older than this are served once more and refreshed in the background
+REVIEW_SUMMARY_TTL = timedelta(hours=float(os.getenv("REVIEW_SUMMARY_TTL_HOURS", "168")))
+
+_flights = SingleFlight()
+_background = set()
+
+
+def normalize_key(value):
+    return " ".join(re.sub(r"[^\w\s]", " ", value.lower()).split())
+
+
+def parse_review_summary(content):
+    # Try to parse the JSON from GPT
+    content = content.strip()
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        # Fallback: remove markdown code block if present
+        cleaned = re.sub(r"^```json|```$", "", content, flags=re.MULTILINE).strip()
+        parsed = json.loads(cleaned)
+
+    return {
+        "pros": parsed.get("pros", []),
+        "cons": parsed.get("cons", []),
+        "summary": parsed.get("summary", ""),
+        "rating": round(float(parsed.get("rating", 4.3)), 1)
+    }
+
+
+def _row_to_dict(row):
+    return {
+        "pros": json.loads(row.pros or "[]"),
+        "cons": json.loads(row.cons or "[]"),
+        "summary": row.summary or "",
+        "rating": row.rating,
+    }
+
+
+def load_summary(place, type):
+    """Return (summary dict, is_stale) for a stored summary, or (None, True)."""
+    db = SessionLocal()
+    try:
+        row = db.query(ReviewSummary).filter(
+            ReviewSummary.place_key == normalize_key(place),
+            ReviewSummary.type_key == normalize_key(type),
+        ).first()
+        if row is None:
+            return None, True
+        stale = row.refreshed_at is None or datetime.utcnow() - row.refreshed_at > REVIEW_SUMMARY_TTL
+        return _row_to_dict(row), stale
+    finally:
+        db.close()
+
+
+def store_summary(place, type, summary):
+    db = SessionLocal()
+    try:
+        place_key, type_key = normalize_key(place), normalize_key(type)
+        row = db.query(ReviewSummary).filter_by(place_key=place_key, type_key=type_key).first()
+        if row is None:
+            row = ReviewSummary(place_key=place_key, type_key=type_key)
+            db.add(row)
+        row.place = place
+        row.type = type
+        row.pros = json.dumps(summary["pros"], ensure_ascii=False)
+        row.cons = json.dumps(summary["cons"], ensure_ascii=False)
+        row.rating = summary["rating"]
+        row.summary = summary["summary"]
+        row.refreshed_at = datetime.utcnow()
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker inserted the same place first; its row is just as good
+            db.rollback()
+    finally:
+        db.close()
+
+
+async def _generate_and_store(place, type, generate):
+    content = await generate()
+    summary = parse_review_summary(content)
+    await run_in_threadpool(store_summary, place, type, summary)
+    return summary
+
+
+async def get_or_create_summary(place, type, generate, admit=None):
+    """
+    Serve a review summary from the store, calling `generate()` (an async
+    function returning the raw LLM output) at most once per place at a time.
+
+    `admit()` is called for each caller before it starts or joins a generation,
+    so it can turn that caller away (e.g. with a 429) without failing the others.
+    Stale summaries are returned immediately and refreshed in the background.
+    """
+    key = (normalize_key(place), normalize_key(type))
+    summary, stale = await run_in_threadpool(load_summary, place, type)
+
+    if summary is None:
+        if admit:
+            admit()
+        return await _flights.do(key, _generate_and_store, place, type, generate)
+
+    if stale and not _flights.in_flight(key):
+        try:
+            if admit:
+                admit()
+        except HTTPException:
+            # Over the limit; the stored summary is still served and someone else refreshes it
+            return summary
+        task = asyncio.create_task(_refresh(key, place, type, generate))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    return summary
+
+
+async def _refresh(key, place, type, generate):
+    try:
+        await _flights.do(key, _generate_and_store, place, type, generate)
+    except Exception as e:
+        logs.warning("reviews.refresh_failed", place=place, type=type, error=str(e))
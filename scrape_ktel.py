@@ -1,19 +1,68 @@
 import os
 import re
-import requests
+import asyncio
+import hashlib
+import tempfile
+from datetime import datetime
+from urllib.parse import urljoin, urlparse
+
+import http_client
+import logs
 from bs4 import BeautifulSoup
+from sqlalchemy.exc import IntegrityError
+from fastapi.concurrency import run_in_threadpool
+from knowledge import KNOWLEDGE_PATH, reload_knowledge
+from models import SessionLocal, BusDeparture, ScrapedPage
+import bus_schedule
+from bus_schedule import normalize_stop, parse_time, format_minute
 
-KTEL_INDEX_URL = "https://ktelparou.gr/en/index.html"
-KNOWLEDGE_FILE = "knowledge_test.txt"  # Update this if needed
+KTEL_INDEX_URL = os.getenv("KTEL_INDEX_URL", "https://ktelparou.gr/en/index.html")
+# Extra timetable pages (comma separated); timetable links found on the index are followed too
+KTEL_TIMETABLE_URLS = [u.strip() for u in os.getenv("KTEL_TIMETABLE_URLS", "").split(",") if u.strip()]
+KTEL_REFRESH_INTERVAL = float(os.getenv("KTEL_REFRESH_HOURS", "6")) * 3600
+MAX_PAGES = 20
+SECTION_MARKER = "## Bus Information (KTEL Paros)"
 
-def fetch_html(url):
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return BeautifulSoup(response.text, 'html.parser')
-    except Exception as e:
-        print(f"[ERROR] Failed to fetch {url}: {e}")
-        return None
+_TIMETABLE_LINK_RE = re.compile(r"route|timetable|schedule|dromolog", re.I)
+_SEASON_PATTERNS = {
+    "summer": re.compile(r"summer|θεριν", re.I),
+    "winter": re.compile(r"winter|χειμεριν", re.I),
+}
+
+_refresher = None
+_lock = asyncio.Lock()
+
+
+def fetch_page(db, url, force=False):
+    """
+    Fetch a page with If-None-Match / If-Modified-Since.
+
+    Returns (state, html); html is None when the page is unchanged, either
+    because the server answered 304 or because its content hash is the same.
+    """
+    state = db.get(ScrapedPage, url)
+    if state is None:
+        state = ScrapedPage(url=url)
+        db.add(state)
+    headers = {}
+    if not force:
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+    response = http_client.get_sync("ktel", url, headers=headers)
+    state.checked_at = datetime.utcnow()
+    if response.status_code == 304:
+        return state, None
+    response.raise_for_status()
+    state.etag = response.headers.get("ETag")
+    state.last_modified = response.headers.get("Last-Modified")
+    digest = hashlib.sha256(response.content).hexdigest()
+    if digest == state.content_hash and not force:
+        return state, None
+    state.content_hash = digest
+    state.changed_at = state.checked_at
+    return state, response.text
 
 def extract_general_bus_info(soup):
     """Extract relevant paragraphs that mention bus-related keywords."""
@@ -23,41 +72,219 @@ def extract_general_bus_info(soup):
         text = p.get_text(" ", strip=True)
         if len(text) > 60 and any(keyword in text.lower() for keyword in ["route", "bus", "station", "schedule", "service", "transport"]):
             content.append(text)
-
-    # ✅ Add the referral to the official site here:
-    content.append("For full, up-to-date bus schedules and departure times, visit the official site: https://ktelparou.gr/en")
     return content[:8]  # Limit to 8 relevant lines
 
-def build_basic_bus_info():
-    soup = fetch_html(KTEL_INDEX_URL)
-    if not soup:
-        return "## Bus Information (KTEL Paros)\nCould not fetch KTEL index page."
+def timetable_links(soup, base_url):
+    host = urlparse(base_url).netloc
+    links = []
+    for a in soup.find_all("a", href=True):
+        url = urljoin(base_url, a["href"]).split("#")[0]
+        if urlparse(url).netloc == host and _TIMETABLE_LINK_RE.search(a["href"] + " " + a.get_text(" ")):
+            links.append(url)
+    return links
+
+def _table_title(table):
+    caption = table.find("caption")
+    if caption and caption.get_text(strip=True):
+        return caption.get_text(" ", strip=True)
+    heading = table.find_previous(["h1", "h2", "h3", "h4", "h5"])
+    return heading.get_text(" ", strip=True) if heading else ""
+
+def _season(title):
+    for season, pattern in _SEASON_PATTERNS.items():
+        if pattern.search(title):
+            return season
+    return "all"
+
+def _stops_by_row(rows):
+    # One row per stop: "Parikia | 08:00 | 12:00 | ..."
+    stops = []
+    for row in rows:
+        if parse_time(row[0]) is None and any(parse_time(c) is not None for c in row[1:]):
+            stops.append((row[0], [parse_time(c) for c in row[1:]]))
+    return stops if len(stops) >= 2 else None
+
+def _stops_by_column(rows):
+    # One column per stop, named in the header row; one row per trip
+    header, body = rows[0], rows[1:]
+    stops = []
+    for j, name in enumerate(header):
+        if not name or parse_time(name) is not None:
+            continue
+        times = [parse_time(row[j]) if j < len(row) else None for row in body]
+        if any(t is not None for t in times):
+            stops.append((name, times))
+    return stops if len(stops) >= 2 else None
 
-    info_lines = ["## Bus Information (KTEL Paros)", f"Source: {KTEL_INDEX_URL}", ""]
-    info_lines += extract_general_bus_info(soup)
-    return "\n".join(info_lines)
+def parse_timetables(soup):
+    """Return (route, season, [(stop, [minute or None per trip]), ...]) for every timetable on the page."""
+    timetables = []
+    for table in soup.find_all("table"):
+        rows = [[cell.get_text(" ", strip=True) for cell in tr.find_all(["td", "th"])] for tr in table.find_all("tr")]
+        rows = [row for row in rows if any(row)]
+        if len(rows) < 2:
+            continue
+        stops = _stops_by_row(rows) or _stops_by_column(rows)
+        if not stops:
+            continue
+        title = _table_title(table) or f"{stops[0][0]} - {stops[-1][0]}"
+        route = re.sub(r"\s*\((summer|winter)[^)]*\)", "", title, flags=re.I).strip() or title
+        timetables.append((route, _season(title), stops))
+    return timetables
+
+def departure_rows(url, timetables, now):
+    rows = []
+    for route, season, stops in timetables:
+        trips = max(len(times) for _, times in stops)
+        for trip in range(trips):
+            sequence = 0
+            for stop, times in stops:
+                minute = times[trip] if trip < len(times) else None
+                if minute is None:
+                    continue
+                rows.append(BusDeparture(
+                    source=url, route=route, season=season, trip=trip, sequence=sequence,
+                    stop=stop, stop_key=normalize_stop(stop), departure_minute=minute, updated_at=now,
+                ))
+                sequence += 1
+    return rows
+
+def build_bus_section(db):
+    """Knowledge-file section: index page summary plus one line per timetable."""
+    lines = [SECTION_MARKER, f"Source: {KTEL_INDEX_URL}", ""]
+    index_page = db.get(ScrapedPage, KTEL_INDEX_URL)
+    if index_page is not None and index_page.summary:
+        lines += index_page.summary.splitlines()
+
+    departures = db.query(BusDeparture).order_by(
+        BusDeparture.route, BusDeparture.season, BusDeparture.trip, BusDeparture.sequence
+    ).all()
+    routes = {}
+    for d in departures:
+        stops = routes.setdefault((d.route, d.season), {})
+        stops.setdefault(d.stop, []).append(d.departure_minute)
+    for (route, season), stops in routes.items():
+        label = route if season == "all" else f"{route} ({season})"
+        times = "; ".join(f"{stop} {', '.join(format_minute(m) for m in sorted(minutes))}" for stop, minutes in stops.items())
+        lines.append(f"- {label} bus times: {times}")
+
+    lines.append("For full, up-to-date bus schedules and departure times, visit the official site: https://ktelparou.gr/en")
+    return "\n".join(lines)
+
+def replace_section(content, section):
+    """Replace the bus section (up to the next '## ' heading) or append it."""
+    lines = content.splitlines()
+    start = next((i for i, line in enumerate(lines) if line.strip() == SECTION_MARKER), None)
+    if start is None:
+        return content.rstrip() + "\n\n" + section + "\n"
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].startswith("## ")), len(lines))
+    updated = lines[:start] + section.splitlines() + ([""] if end < len(lines) else []) + lines[end:]
+    return "\n".join(updated) + "\n"
+
+def write_knowledge_section(section, path=KNOWLEDGE_PATH):
+    """Atomically rewrite the knowledge file with a new bus section; returns True if it changed."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        content, mode = "", 0o644
+    updated = replace_section(content, section)
+    if updated == content:
+        return False
+
+    # Write next to the target and rename over it so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".knowledge-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(updated)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    reload_knowledge()
+    return True
+
+def ingest(force=False):
+    """
+    Check every KTEL page, re-parse the ones that changed and update the
+    bus_departures table, the knowledge file section and the in-memory index.
+    """
+    db = SessionLocal()
+    try:
+        known = [url for (url,) in db.query(BusDeparture.source).distinct()]
+        queue = list(dict.fromkeys([KTEL_INDEX_URL] + KTEL_TIMETABLE_URLS + known))
+        checked = changed = 0
+        while queue and checked < MAX_PAGES:
+            url = queue.pop(0)
+            checked += 1
+            try:
+                state, html = fetch_page(db, url, force)
+            except Exception as e:
+                logs.warning("ktel.fetch_failed", url=url, error=str(e))
+                db.rollback()
+                continue
+            rows = None
+            if html is not None:
+                soup = BeautifulSoup(html, "html.parser")
+                if url == KTEL_INDEX_URL:
+                    state.summary = "\n".join(extract_general_bus_info(soup))
+                    queue += [link for link in timetable_links(soup, url) if link not in queue and link != url]
+                rows = departure_rows(url, parse_timetables(soup), state.checked_at)
+                # Replace this page's rows and record its new validators in one transaction
+                db.query(BusDeparture).filter(BusDeparture.source == url).delete(synchronize_session=False)
+                db.add_all(rows)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker recorded this page first; it will have stored the same rows
+                db.rollback()
+                continue
+            if rows is not None:
+                changed += 1
+                logs.info("ktel.page_changed", url=url, departures=len(rows))
 
-def update_knowledge_file_basic_summary():
-    """Replace everything after '## Bus Information (KTEL Paros)' with fresh summary."""
-    new_section = build_basic_bus_info()
+        knowledge_updated = False
+        if changed or force:
+            knowledge_updated = write_knowledge_section(build_bus_section(db))
+    finally:
+        db.close()
 
-    if not os.path.exists(KNOWLEDGE_FILE):
-        with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-            f.write(new_section)
-        print("[INFO] Created new knowledge file with basic KTEL info.")
-        return
+    index = bus_schedule.load_index() if changed or force else bus_schedule.get_index()
+    return {
+        "pages_checked": checked,
+        "pages_changed": changed,
+        "departures": len(index),
+        "knowledge_updated": knowledge_updated,
+    }
 
-    with open(KNOWLEDGE_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
+async def refresh(force=False):
+    """Run one ingest off the event loop; concurrent callers wait for the running one."""
+    async with _lock:
+        return await run_in_threadpool(ingest, force)
 
-    marker = "## Bus Information (KTEL Paros)"
-    if marker in content:
-        before = content.split(marker)[0].rstrip()
-        content = f"{before}\n{new_section}"
-    else:
-        content += "\n\n" + new_section
+async def _refresh_loop():
+    while True:
+        try:
+            await refresh()
+        except Exception as e:
+            logs.warning("ktel.ingest_failed", error=str(e))
+        await asyncio.sleep(KTEL_REFRESH_INTERVAL)
 
-    with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-        f.write(content)
+def start_ingester():
+    global _refresher
+    if _refresher is None:
+        _refresher = asyncio.create_task(_refresh_loop())
 
-    print("[INFO] knowledge_test.txt updated with basic summary.")
+async def stop_ingester():
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        try:
+            await _refresher
+        except asyncio.CancelledError:
+            pass
+        _refresher = None
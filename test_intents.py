@@ -0,0 +1,49 @@
+# test_intents.py
+import asyncio
+
+import pytest
+
+import intents
+
+# Travel questions that mention a weather word or a service keyword but do not
+# ask for live data; they must fall through to the LLM.
+GENERAL_QUESTIONS = [
+    "Which beaches are sheltered from the wind?",
+    "What is the best time of year to avoid rain?",
+    "Is the water temperature warm enough to swim in May?",
+    "Do I need a GPS to drive around Paros?",
+    "Is medical insurance required for visitors to Greece?",
+    "Which banks of the island are best for fishing?",
+    "What is the weather like in Paros in August?",
+    "Is it open?",
+    "Is the place open now?",
+]
+
+
+@pytest.fixture(autouse=True)
+def no_model(monkeypatch):
+    # Only the rules are under test; a locally trained model must not change the outcome
+    monkeypatch.setattr(intents, "model", None)
+
+
+@pytest.mark.parametrize("question", GENERAL_QUESTIONS)
+def test_general_questions_go_to_llm(question):
+    assert intents.classify(question) == (None, None)
+    assert asyncio.run(intents.route_question(question)) == (None, None)
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("What's the weather today?", "weather"),
+    ("Will it rain tomorrow?", "weather"),
+    ("What's the forecast?", "weather"),
+    ("Where is the nearest pharmacy?", "services"),
+    ("Is there an ATM near me?", "services"),
+    ("Is Barbarossa open now?", "open_now"),
+])
+def test_live_questions_are_routed(question, intent):
+    assert intents.classify(question)[0] == intent
+
+
+def test_open_now_takes_the_place_name():
+    _, match = intents.classify("Is the Archaeological Museum open today?")
+    assert match.group("name") == "Archaeological Museum"
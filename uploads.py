@@ -0,0 +1,230 @@
+# uploads.py
+import os
+import re
+import time
+import codecs
+import asyncio
+import hashlib
+import zipfile
+import tempfile
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+import logs
+
+try:
+    import pypdf
+except ImportError:  # PDF uploads contribute no text without pypdf
+    pypdf = None
+
+# Hard cap on the request body of upload endpoints; larger uploads get a 413
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+# Characters of text extracted for the prompt; extraction stops once it has them and
+# prompts.PROMPT_UPLOAD_TOKENS then trims the text to its token budget at a word break
+UPLOAD_TEXT_CHARS = int(os.getenv("UPLOAD_TEXT_CHARS", "2000"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+CHUNK_SIZE = 64 * 1024
+
+# Set UPLOAD_DEBUG=1 to keep recent uploads in a bounded temp directory
+UPLOAD_DEBUG = os.getenv("UPLOAD_DEBUG", "0") == "1"
+UPLOAD_DEBUG_DIR = os.getenv("UPLOAD_DEBUG_DIR", os.path.join(tempfile.gettempdir(), "parosmate-uploads"))
+UPLOAD_DEBUG_MAX_FILES = int(os.getenv("UPLOAD_DEBUG_MAX_FILES", "50"))
+UPLOAD_DEBUG_MAX_BYTES = int(os.getenv("UPLOAD_DEBUG_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_executor = None
+
+
+@dataclass(frozen=True)
+class UploadText:
+    text: str
+    kind: str  # "text", "pdf", "docx" or "unsupported"
+    digest: str  # hash of the extracted text, i.e. of what reaches the prompt
+
+
+def _too_large():
+    limit = f"{UPLOAD_MAX_BYTES // (1024 * 1024)} MB" if UPLOAD_MAX_BYTES >= 1024 * 1024 else f"{UPLOAD_MAX_BYTES // 1024} KB"
+    return HTTPException(status_code=413, detail=f"Upload exceeds the {limit} limit")
+
+
+class UploadLimitMiddleware:
+    """
+    Reject request bodies over UPLOAD_MAX_BYTES on the given paths.
+
+    Checked against Content-Length up front and while the body streams in, so an
+    oversized upload is cut off before it is fully received or spooled.
+    """
+
+    def __init__(self, app, paths=("/ask",), max_bytes=UPLOAD_MAX_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            error = _too_large()
+            await JSONResponse({"detail": error.detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _detect_kind(head, filename, content_type):
+    name = (filename or "").lower()
+    if head.startswith(b"%PDF") or name.endswith(".pdf") or content_type == "application/pdf":
+        return "pdf"
+    if head.startswith(b"PK\x03\x04") and (name.endswith(".docx") or "wordprocessingml" in (content_type or "")):
+        return "docx"
+    if head.startswith(b"PK\x03\x04") or b"\x00" in head[:1024]:
+        return "unsupported"  # other binary formats
+    return "text"
+
+
+def _extract_plain(f, limit):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    parts = []
+    size = 0
+    while size < limit:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        parts.append(text)
+        size += len(text)
+    return "".join(parts)[:limit]
+
+
+def _extract_pdf(f, limit):
+    if pypdf is None:
+        return ""
+    parts = []
+    size = 0
+    for page in pypdf.PdfReader(f).pages:
+        text = page.extract_text() or ""
+        parts.append(text)
+        size += len(text)
+        if size >= limit:
+            break
+    return "\n".join(parts)[:limit]
+
+
+def _extract_docx(f, limit):
+    parts = []
+    size = 0
+    with zipfile.ZipFile(f) as archive, archive.open("word/document.xml") as document:
+        # iterparse streams the XML instead of building the whole tree
+        for _, element in ElementTree.iterparse(document):
+            if element.tag == f"{_WORD_NS}t" and element.text:
+                parts.append(element.text)
+                size += len(element.text)
+            elif element.tag == f"{_WORD_NS}p":
+                parts.append("\n")
+            element.clear()
+            if size >= limit:
+                break
+    return "".join(parts).strip()[:limit]
+
+
+def _extract(f, filename, content_type, limit):
+    f.seek(0)
+    head = f.read(2048)
+    f.seek(0)
+    kind = _detect_kind(head, filename, content_type)
+    try:
+        if kind == "pdf":
+            text = _extract_pdf(f, limit)
+        elif kind == "docx":
+            text = _extract_docx(f, limit)
+        elif kind == "text":
+            text = _extract_plain(f, limit)
+        else:
+            text = ""
+    except Exception as e:
+        logs.warning("uploads.extract_failed", filename=filename, kind=kind, error=str(e))
+        text = ""
+    return text, kind
+
+
+def _safe_name(filename):
+    name = re.sub(r"[^\w.-]", "_", os.path.basename(filename or "upload"))
+    return name.lstrip(".")[:80] or "upload"
+
+
+def _save_debug_copy(f, filename):
+    """Copy the upload into the debug store, evicting the oldest files over the limits."""
+    os.makedirs(UPLOAD_DEBUG_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DEBUG_DIR, f"{time.time_ns()}-{_safe_name(filename)}")
+    f.seek(0)
+    with open(path, "wb") as out:
+        while chunk := f.read(CHUNK_SIZE):
+            out.write(chunk)
+
+    entries = []
+    for entry in os.scandir(UPLOAD_DEBUG_DIR):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > UPLOAD_DEBUG_MAX_FILES or total > UPLOAD_DEBUG_MAX_BYTES):
+        _, size, old = entries.pop(0)
+        total -= size
+        try:
+            os.unlink(old)
+        except FileNotFoundError:
+            pass
+
+
+def _process(f, filename, content_type, limit):
+    text, kind = _extract(f, filename, content_type, limit)
+    if UPLOAD_DEBUG:
+        try:
+            _save_debug_copy(f, filename)
+        except OSError as e:
+            logs.warning("uploads.debug_copy_failed", filename=filename, error=str(e))
+    return text, kind
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def read_upload(file: UploadFile, limit=UPLOAD_TEXT_CHARS):
+    """
+    Extract up to `limit` characters of text from an upload without loading it whole.
+
+    The spooled upload is read in chunks on a small worker pool, so parsing
+    never blocks the event loop and only UPLOAD_WORKERS files are parsed at once.
+    """
+    global _executor
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise _too_large()
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+    text, kind = await asyncio.get_running_loop().run_in_executor(
+        _executor, _process, file.file, file.filename, file.content_type, limit
+    )
+    return UploadText(text=text, kind=kind, digest=hashlib.sha256(text.encode("utf-8")).hexdigest())
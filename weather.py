@@ -0,0 +1,146 @@
+# weather.py
+import os
+import time
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import logs
+import http_client
+from fastapi import APIRouter, HTTPException, Request
+from http_cache import cached_json
+from dotenv import load_dotenv
+from cache import SingleFlight
+
+load_dotenv()
+
+router = APIRouter()
+
+OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5")
+LAT, LON = 37.084, 25.150
+
+# Seconds between upstream refreshes; requests never wait on a refresh once data exists
+WEATHER_REFRESH_INTERVAL = float(os.getenv("WEATHER_REFRESH_INTERVAL", "600"))
+
+# kind -> (payload, fetched_at monotonic)
+_snapshots = {}
+_flights = SingleFlight()
+_refresher = None
+_background = set()
+
+
+async def _fetch(kind):
+    response = await http_client.get("openweather", f"{OPENWEATHER_URL}/{kind}", params={
+        "lat": LAT,
+        "lon": LON,
+        "appid": OPENWEATHER_API_KEY,
+        "units": "metric",
+    })
+    data = response.json()
+    if str(data.get("cod")) != "200":
+        raise RuntimeError(f"OpenWeather {kind} error: {data.get('message', data.get('cod'))}")
+    _snapshots[kind] = (data, time.monotonic())
+    return data
+
+
+async def refresh(kind):
+    """Fetch `kind` ("weather" or "forecast"); on failure the last good value is kept."""
+    try:
+        return await _flights.do(kind, _fetch, kind)
+    except Exception as e:
+        logs.warning("weather.refresh_failed", kind=kind, error=str(e))
+        return None
+
+
+async def get_weather(kind):
+    """
+    Return the latest OpenWeather payload for `kind` from memory.
+
+    Only the very first call (before any data exists) waits on the upstream.
+    Stale values are returned immediately while a refresh runs in the background.
+    """
+    snapshot = _snapshots.get(kind)
+    if snapshot is None:
+        await refresh(kind)
+        snapshot = _snapshots.get(kind)
+        return snapshot[0] if snapshot else None
+
+    data, fetched_at = snapshot
+    if time.monotonic() - fetched_at > WEATHER_REFRESH_INTERVAL and not _flights.in_flight(kind):
+        task = asyncio.create_task(refresh(kind))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    return data
+
+
+def freshness(kind):
+    """Seconds until the stored `kind` payload is due for a refresh."""
+    snapshot = _snapshots.get(kind)
+    if snapshot is None:
+        return 0
+    return max(0, WEATHER_REFRESH_INTERVAL - (time.monotonic() - snapshot[1]))
+
+
+async def _refresh_loop():
+    while True:
+        await asyncio.gather(refresh("weather"), refresh("forecast"))
+        await asyncio.sleep(WEATHER_REFRESH_INTERVAL)
+
+
+def start_refresher():
+    global _refresher
+    if _refresher is None:
+        _refresher = asyncio.create_task(_refresh_loop())
+
+
+async def stop_refresher():
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        try:
+            await _refresher
+        except asyncio.CancelledError:
+            pass
+        _refresher = None
+
+
+async def get_paros_weather():
+    data = await get_weather("weather")
+    if not data:
+        return "Weather information is currently unavailable."
+    weather = data["weather"][0]["description"].capitalize()
+    temp = data["main"]["temp"]
+    return f"The current weather in Paros is {weather} with a temperature of {temp}°C."
+
+
+async def get_paros_forecast(days_ahead=1):
+    """One-line summary (min/max temperature, main conditions) of a coming day."""
+    data = await get_weather("forecast")
+    if not data:
+        return "The weather forecast is currently unavailable."
+    offset = timedelta(seconds=data.get("city", {}).get("timezone", 0))
+    target = (datetime.now(timezone.utc) + offset).date() + timedelta(days=days_ahead)
+    items = [i for i in data.get("list", [])
+             if (datetime.fromtimestamp(i["dt"], timezone.utc) + offset).date() == target]
+    if not items:
+        return "The weather forecast for that day is not available yet."
+    temps = [i["main"]["temp"] for i in items]
+    conditions = Counter(i["weather"][0]["description"] for i in items).most_common(1)[0][0]
+    day = "Tomorrow" if days_ahead == 1 else target.strftime("%A")
+    return f"{day} in Paros: {conditions}, between {min(temps):.0f}°C and {max(temps):.0f}°C."
+
+
+@router.get("/weather/current")
+async def get_current_weather(request: Request):
+    data = await get_weather("weather")
+    if data is None:
+        raise HTTPException(status_code=503, detail="Weather information is currently unavailable.")
+    return cached_json(request, data, max_age=freshness("weather"), stale_while_revalidate=60)
+
+
+@router.get("/weather/forecast")
+async def get_forecast_weather(request: Request):
+    data = await get_weather("forecast")
+    if data is None:
+        raise HTTPException(status_code=503, detail="Weather information is currently unavailable.")
+    return cached_json(request, data, max_age=freshness("forecast"), stale_while_revalidate=60)